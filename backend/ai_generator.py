@@ -1,8 +1,108 @@
-from typing import Any
+import asyncio
+import weakref
+from collections.abc import AsyncIterator, Coroutine
+from functools import lru_cache
+from typing import TYPE_CHECKING, Any
 
-import anthropic
 from config import config
 
+# anthropic (with httpx and its pydantic models) is imported on first use rather than at
+# module import, so startup and test collection don't pay for it until a client is needed
+if TYPE_CHECKING:
+    import anthropic
+    import httpx
+
+
+@lru_cache(maxsize=1)
+def _orjson_http_client_class() -> type:
+    """
+    Build (once) the SDK's default async httpx client class with orjson request bodies.
+
+    The SDK passes every request body to build_request(json=...), which httpx encodes
+    with the stdlib json module. Tool rounds resend all earlier tool results, so bodies
+    grow with every round; orjson encodes them several times faster. Built lazily because
+    the base class comes from anthropic.
+    """
+    import anthropic
+    import httpx
+    import orjson
+
+    class OrjsonAsyncHttpxClient(anthropic.DefaultAsyncHttpxClient):
+        def build_request(self, method, url, *, content=None, json=None, headers=None, **kwargs):
+            if json is not None and content is None:
+                content = orjson.dumps(json)
+                json = None
+                headers = httpx.Headers(headers)
+                headers.setdefault("Content-Type", "application/json")
+            return super().build_request(
+                method, url, content=content, json=json, headers=headers, **kwargs
+            )
+
+    return OrjsonAsyncHttpxClient
+
+
+# AsyncAnthropic clients per event loop and API key. An httpx pool's connections belong to
+# the loop that opened them, so a client must never outlive its loop: reusing one from a
+# closed loop fails with "Event loop is closed" and burns a retry on every request.
+_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, dict[str, Any]]" = (
+    weakref.WeakKeyDictionary()
+)
+
+
+def _get_client(api_key: str) -> "anthropic.AsyncAnthropic":
+    """
+    Return the running event loop's AsyncAnthropic client for an API key.
+
+    All AIGenerator instances on a loop share one pooled httpx transport so keep-alive
+    connections (and their TLS handshakes) are reused across calls. HTTP/2 multiplexes
+    concurrent requests, including every tool round of every user, over those connections.
+    The client is shared state: callers must not mutate it; pass per-call overrides as
+    request arguments. Request bodies are serialised with orjson.
+    """
+    loop_clients = _clients.setdefault(asyncio.get_running_loop(), {})
+    client = loop_clients.get(api_key)
+    if client is None:
+        client = loop_clients[api_key] = _new_client(api_key)
+    return client
+
+
+def _new_client(api_key: str) -> "anthropic.AsyncAnthropic":
+    """Build an AsyncAnthropic client with the pooled HTTP/2 transport"""
+    import anthropic
+    import httpx
+
+    limits = httpx.Limits(
+        max_connections=config.HTTP_MAX_CONNECTIONS,
+        max_keepalive_connections=config.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+        keepalive_expiry=config.HTTP_KEEPALIVE_EXPIRY,
+    )
+    # Transport-level retries only cover failed connection attempts; the SDK retries requests
+    transport = httpx.AsyncHTTPTransport(http2=True, limits=limits, retries=2)
+    return anthropic.AsyncAnthropic(
+        api_key=api_key,
+        timeout=httpx.Timeout(config.REQUEST_TIMEOUT, connect=config.CONNECT_TIMEOUT),
+        max_retries=2,
+        http_client=_orjson_http_client_class()(transport=transport),
+    )
+
+
+def run_sync[T](coro: Coroutine[Any, Any, T]) -> T:
+    """
+    Run a coroutine on a fresh event loop, closing the clients it created before returning.
+
+    The synchronous entry points use this instead of asyncio.run() alone, so their pooled
+    connections are shut down with the loop they belong to rather than left for reuse.
+    """
+
+    async def run() -> T:
+        try:
+            return await coro
+        finally:
+            for client in _clients.pop(asyncio.get_running_loop(), {}).values():
+                await client.close()
+
+    return asyncio.run(run())
+
 
 class AIGenerator:
     """Handles interactions with Anthropic's Claude API for generating responses"""
@@ -41,101 +141,406 @@ All responses must be:
 Provide only the direct answer to what was asked.
 """
 
-    def __init__(self, api_key: str, model: str):
-        self.client = anthropic.Anthropic(api_key=api_key)
+    # Prompt-cache breakpoint marker (cached server-side for ~5 minutes)
+    CACHE_CONTROL = {"type": "ephemeral"}
+
+    # The system prompt is identical for every call, so every request shares one prebuilt
+    # block list (never mutated) and the prompt stays cacheable across users
+    _SYSTEM_BLOCKS = [{"type": "text", "text": SYSTEM_PROMPT, "cache_control": CACHE_CONTROL}]
+
+    # Shared tool_choice value; never mutated, so no per-call allocation
+    _TOOL_CHOICE_AUTO = {"type": "auto"}
+
+    # Returned in place of an answer when the API does not respond in time
+    TIMEOUT_MESSAGE = "Sorry, generating a response took too long. Please try again."
+
+    def __init__(
+        self,
+        api_key: str,
+        model: str,
+        tools: list | None = None,
+        router_model: str | None = None,
+    ):
+        self.api_key = api_key
+        # Set only to override the per-loop shared client, e.g. with a test double
+        self._client: anthropic.AsyncAnthropic | None = None
         self.model = model
 
+        # Rounds that only decide which tool to call can run on a faster, cheaper model;
+        # the answer itself always comes from self.model
+        self.router_model = router_model or model
+
         # Pre-build base API parameters
         self.base_params = {"model": self.model, "temperature": 0, "max_tokens": 800}
 
+        # Default tool definitions, cache breakpoint applied once up front
+        self.tools = self._with_cache_breakpoint(tools) if tools else None
+
+    @property
+    def client(self) -> "anthropic.AsyncAnthropic":
+        """The assigned client, else the running event loop's shared client for the API key"""
+        if self._client is not None:
+            return self._client
+        return _get_client(self.api_key)
+
+    @client.setter
+    def client(self, client: "anthropic.AsyncAnthropic") -> None:
+        self._client = client
+
     def generate_response(
         self,
         query: str,
-        conversation_history: str | None = None,
+        history_messages: list[dict[str, Any]] | None = None,
+        tools: list | None = None,
+        tool_manager=None,
+        sources: list | None = None,
+    ) -> str:
+        """
+        Synchronous wrapper around agenerate_response() for callers without an event loop.
+
+        Must not be called from inside a running event loop (e.g. a FastAPI handler);
+        await agenerate_response() there instead.
+        """
+        return run_sync(
+            self.agenerate_response(
+                query,
+                history_messages=history_messages,
+                tools=tools,
+                tool_manager=tool_manager,
+                sources=sources,
+            )
+        )
+
+    async def agenerate_response(
+        self,
+        query: str,
+        history_messages: list[dict[str, Any]] | None = None,
         tools: list | None = None,
         tool_manager=None,
+        sources: list | None = None,
     ) -> str:
         """
         Generate AI response with optional tool usage and conversation context.
 
         Args:
             query: The user's question or request
-            conversation_history: Previous messages for context
-            tools: Available tools the AI can use
+            history_messages: Previous turns as alternating user/assistant messages
+            tools: Available tools the AI can use (defaults to the constructor's tools)
             tool_manager: Manager to execute tools
+            sources: Optional list that receives the sources of every tool call made
 
         Returns:
-            Generated response as string
+            Generated response as string, or TIMEOUT_MESSAGE if the API timed out
         """
+        from anthropic import APITimeoutError
 
-        # Build system content efficiently - avoid string ops when possible
-        system_content = (
-            f"{self.SYSTEM_PROMPT}\n\nPrevious conversation:\n{conversation_history}"
-            if conversation_history
-            else self.SYSTEM_PROMPT
-        )
+        api_params = self._build_api_params(query, history_messages, tools)
+        messages = api_params["messages"]
 
-        # Initialize messages with user query
-        messages = [{"role": "user", "content": query}]
-        round_count = 0
+        # Content block currently carrying the conversation cache breakpoint
+        cached_block: dict[str, Any] | None = None
 
-        while round_count < config.MAX_TOOL_ROUNDS:
-            # Prepare API call parameters
-            api_params = {**self.base_params, "messages": messages, "system": system_content}
+        # Set when the router model stops calling tools, so the next round writes the answer
+        answer_next = False
 
-            # Add tools if available
-            if tools:
-                api_params["tools"] = tools
-                api_params["tool_choice"] = {"type": "auto"}
+        # Up to MAX_TOOL_ROUNDS tool rounds plus one forced answer, through one call site
+        for round_count in range(config.MAX_TOOL_ROUNDS + 1):
+            final_round = answer_next or round_count == config.MAX_TOOL_ROUNDS
 
-            # Get response from Claude
-            response = self.client.messages.create(**api_params)
+            # Max rounds reached - final call WITHOUT tools to force a response
+            if final_round:
+                api_params.pop("tools", None)
+                api_params.pop("tool_choice", None)
+            routing = self._select_model(api_params)
 
-            # If not a tool use response, return the text
-            if response.stop_reason != "tool_use" or not tool_manager:
-                return response.content[0].text
+            # Get response from Claude; retries are handled by the client
+            try:
+                response = await self.client.messages.create(
+                    **api_params, timeout=self._request_timeout(api_params)
+                )
+            except APITimeoutError:
+                return self.TIMEOUT_MESSAGE
+
+            # Without tool calls to run the response is the answer, even if it was
+            # interleaved with a tool_use block that cannot be executed
+            if not self._has_tool_use(response) or not tool_manager or final_round:
+                if routing:
+                    # The router is done with tools; the configured model writes the answer
+                    answer_next = True
+                    continue
+                return self._response_text(response)
 
             # Execute tools and accumulate messages
-            tool_results = self._execute_tools_from_response(response, tool_manager)
+            tool_results = await self._execute_tools_from_response(response, tool_manager, sources)
+            cached_block = self._append_tool_round(
+                messages, response.content, tool_results, cached_block
+            )
 
-            # Add assistant's tool use response
-            messages.append({"role": "assistant", "content": response.content})
+        raise AssertionError("unreachable: the final round always returns")
 
-            # Add tool results as user message
-            messages.append({"role": "user", "content": tool_results})
+    async def astream_response(
+        self,
+        query: str,
+        history_messages: list[dict[str, Any]] | None = None,
+        tools: list | None = None,
+        tool_manager=None,
+        sources: list | None = None,
+    ) -> AsyncIterator[str]:
+        """
+        Stream the AI response as text chunks while it is being generated.
 
-            round_count += 1
+        Every round is streamed. When a round ends in tool use, the tools are executed
+        and the next round continues the stream; the last round runs without tools.
 
-        # Max rounds reached - final call WITHOUT tools to force a response
-        final_params = {**self.base_params, "messages": messages, "system": system_content}
+        Args:
+            query: The user's question or request
+            history_messages: Previous turns as alternating user/assistant messages
+            tools: Available tools the AI can use (defaults to the constructor's tools)
+            tool_manager: Manager to execute tools
+            sources: Optional list that receives the sources of every tool call made
 
-        final_response = self.client.messages.create(**final_params)
-        return final_response.content[0].text
+        Yields:
+            Text chunks of the response in generation order, ending with TIMEOUT_MESSAGE
+            if the API timed out
+        """
+        from anthropic import APITimeoutError
+
+        api_params = self._build_api_params(query, history_messages, tools)
+        messages = api_params["messages"]
+        cached_block: dict[str, Any] | None = None
+        answer_next = False
+
+        for round_count in range(config.MAX_TOOL_ROUNDS + 1):
+            final_round = answer_next or round_count == config.MAX_TOOL_ROUNDS
+
+            # Max rounds reached - stream the final round WITHOUT tools to force a response
+            if final_round:
+                api_params.pop("tools", None)
+                api_params.pop("tool_choice", None)
+            routing = self._select_model(api_params)
+
+            try:
+                async with self.client.messages.stream(
+                    **api_params, timeout=self._request_timeout(api_params)
+                ) as stream:
+                    async for text in stream.text_stream:
+                        # Router text is never shown; only the configured model answers
+                        if not routing:
+                            yield text
+                    # Tool rounds need the complete message before they can continue
+                    response = await stream.get_final_message()
+            except APITimeoutError:
+                yield self.TIMEOUT_MESSAGE
+                return
+
+            if not self._has_tool_use(response) or not tool_manager or final_round:
+                if routing:
+                    answer_next = True
+                    continue
+                return
+
+            tool_results = await self._execute_tools_from_response(response, tool_manager, sources)
+            cached_block = self._append_tool_round(
+                messages, response.content, tool_results, cached_block
+            )
+
+    def generate_batch(self, queries: list[str]) -> list[str]:
+        """
+        Synchronous wrapper around agenerate_batch() for offline scripts and evaluation runs.
+        """
+        return run_sync(self.agenerate_batch(queries))
 
-    def _execute_tools_from_response(self, response, tool_manager) -> list[dict[str, Any]]:
+    async def agenerate_batch(self, queries: list[str]) -> list[str]:
         """
-        Execute all tool calls from a response and return tool results.
+        Answer many independent queries through the Message Batches API.
+
+        Batched requests cost half as much per token but complete asynchronously (minutes
+        to hours), so this is meant for bulk jobs such as evaluation sweeps, not live
+        traffic. No tools are offered because a batch request cannot run tool rounds;
+        tool-dependent queries belong on agenerate_response() or astream_response().
+
+        Args:
+            queries: Independent user questions
+
+        Returns:
+            Response texts in the same order as queries; requests that did not succeed
+            are reported as "Batch request <result type>"
+        """
+        if not queries:
+            return []
+
+        batch = await self.client.messages.batches.create(
+            requests=[
+                {"custom_id": str(index), "params": self._build_api_params(query, None, [])}
+                for index, query in enumerate(queries)
+            ]
+        )
+
+        while batch.processing_status != "ended":
+            await asyncio.sleep(config.BATCH_POLL_INTERVAL)
+            batch = await self.client.messages.batches.retrieve(batch.id)
+
+        # Results arrive in completion order; custom_id maps them back to their query
+        responses = [""] * len(queries)
+        async for entry in await self.client.messages.batches.results(batch.id):
+            if entry.result.type == "succeeded":
+                text = self._response_text(entry.result.message)
+            else:
+                text = f"Batch request {entry.result.type}"
+            responses[int(entry.custom_id)] = text
+
+        return responses
+
+    def _build_api_params(
+        self,
+        query: str,
+        history_messages: list[dict[str, Any]] | None,
+        tools: list | None,
+    ) -> dict[str, Any]:
+        """Build the request parameters shared by every round of a single query"""
+        # Prior turns go in messages rather than the system prompt, and the latest answer
+        # carries a breakpoint so the next turn reads the whole session prefix from cache
+        messages = []
+        if history_messages:
+            *earlier, last = history_messages
+            messages.extend(earlier)
+            # The API rejects an empty text block, so an empty turn is sent without one
+            if last["content"]:
+                last = {
+                    "role": last["role"],
+                    "content": [
+                        {
+                            "type": "text",
+                            "text": last["content"],
+                            "cache_control": self.CACHE_CONTROL,
+                        }
+                    ],
+                }
+            messages.append(last)
+        messages.append({"role": "user", "content": query})
+
+        # Built once per query; the dict holds a reference to the messages list, so rounds
+        # append to it in place and the final round pops tools instead of rebuilding it
+        api_params = self.base_params.copy()
+        api_params["messages"] = messages
+        api_params["system"] = self._SYSTEM_BLOCKS
+
+        # Add tools if available, marking the end of the definitions so they are cached too;
+        # None falls back to the tools given at construction, [] disables tools
+        if tools is None:
+            tools = self.tools
+        elif tools:
+            tools = self._with_cache_breakpoint(tools)
+        if tools:
+            api_params["tools"] = tools
+            api_params["tool_choice"] = self._TOOL_CHOICE_AUTO
+
+        return api_params
+
+    def _append_tool_round(
+        self,
+        messages: list[dict[str, Any]],
+        assistant_content: list,
+        tool_results: list[dict[str, Any]],
+        cached_block: dict[str, Any] | None,
+    ) -> dict[str, Any]:
+        """
+        Append a tool-use exchange to messages and move the conversation cache breakpoint.
+
+        Only one tool-round breakpoint lives in messages (the API allows four, and tools,
+        system and the session history already use up to three), so it moves to the newest
+        tool result and the next round is served from the cached prefix instead of
+        re-processing earlier rounds.
+
+        Returns:
+            The content block now carrying the breakpoint
+        """
+        if cached_block is not None:
+            cached_block.pop("cache_control", None)
+        tool_results[-1]["cache_control"] = self.CACHE_CONTROL
+
+        # Add assistant's tool use response
+        messages.append({"role": "assistant", "content": assistant_content})
+
+        # Add tool results as user message
+        messages.append({"role": "user", "content": tool_results})
+
+        return tool_results[-1]
+
+    @staticmethod
+    def _has_tool_use(response) -> bool:
+        """Whether a response asks for at least one tool call"""
+        return any(block.type == "tool_use" for block in response.content)
+
+    @staticmethod
+    def _response_text(response) -> str:
+        """Join the text blocks of a response, skipping tool_use and other block types"""
+        return "".join(block.text for block in response.content if block.type == "text")
+
+    def _select_model(self, api_params: dict[str, Any]) -> bool:
+        """
+        Point api_params at the model for the next round.
+
+        Rounds that offer tools go to the router model and the tool-free answer round to
+        self.model. Returns True when the round is routed to a different model than
+        self.model, i.e. its output is only used to pick tools.
+        """
+        api_params["model"] = self.router_model if "tools" in api_params else self.model
+        return api_params["model"] != self.model
+
+    def _request_timeout(self, api_params: dict[str, Any]) -> "httpx.Timeout":
+        """
+        Per-request timeout: short while tools are offered, longer for the answer round.
+
+        A bare float would replace the client's timeout outright, connect phase included,
+        so the connect limit is carried over explicitly.
+        """
+        import httpx
+
+        budget = config.TOOL_ROUND_TIMEOUT if "tools" in api_params else config.REQUEST_TIMEOUT
+        return httpx.Timeout(budget, connect=config.CONNECT_TIMEOUT)
+
+    def _with_cache_breakpoint(self, tools: list) -> list:
+        """Return a copy of tools whose last definition carries a cache breakpoint"""
+        return [*tools[:-1], {**tools[-1], "cache_control": self.CACHE_CONTROL}]
+
+    async def _execute_tools_from_response(
+        self, response, tool_manager, sources: list | None = None
+    ) -> list[dict[str, Any]]:
+        """
+        Execute all tool calls from a response concurrently and return tool results.
 
         Args:
             response: The response containing tool use blocks
             tool_manager: Manager to execute tools
+            sources: Optional list extended, in block order, with each call's sources
 
         Returns:
-            List of tool_result dicts ready to be added to messages
+            List of tool_result dicts ready to be added to messages, in block order
         """
-        tool_results = []
+        tool_blocks = [block for block in response.content if block.type == "tool_use"]
 
-        for content_block in response.content:
-            if content_block.type == "tool_use":
-                try:
-                    tool_result = tool_manager.execute_tool(
-                        content_block.name, **content_block.input
-                    )
-                except Exception as e:
-                    tool_result = f"Tool execution error: {str(e)}"
-
-                tool_results.append(
-                    {"type": "tool_result", "tool_use_id": content_block.id, "content": tool_result}
-                )
+        # Independent tool calls overlap instead of adding up their latencies
+        results = await asyncio.gather(
+            *(tool_manager.aexecute_tool(block.name, **block.input) for block in tool_blocks),
+            return_exceptions=True,
+        )
+
+        tool_results = []
+        for block, result in zip(tool_blocks, results, strict=True):
+            if isinstance(result, BaseException):
+                # Only tool failures go back to Claude; cancellation and exits propagate
+                if not isinstance(result, Exception):
+                    raise result
+                result = f"Tool execution error: {str(result)}"
+            else:
+                # Sources come back with each call, not from tool state other calls share
+                result, call_sources = result
+                if sources is not None:
+                    # Calls in the same round or in different rounds can cite the same
+                    # lesson; list it once
+                    sources.extend(s for s in call_sources if s not in sources)
+
+            tool_results.append({"type": "tool_result", "tool_use_id": block.id, "content": result})
 
         return tool_results
@@ -0,0 +1,157 @@
+import asyncio
+import hashlib
+from collections.abc import AsyncIterator
+from functools import lru_cache
+from typing import NotRequired, TypedDict
+
+import orjson
+from config import config
+from fastapi import HTTPException
+from fastapi.exceptions import RequestValidationError
+from fastapi.openapi.utils import validation_error_definition
+from fastapi.responses import Response
+from pydantic import BaseModel, ValidationError
+
+
+class QueryRequest(BaseModel):
+    """Request model for course queries; documents the body parse_query_payload accepts"""
+
+    query: str
+    session_id: str | None = None
+
+
+# openapi_extra for the query endpoints, which read the raw body instead of a QueryRequest
+# parameter; the schemas are inlined because these routes register no components, and the
+# 422 that FastAPI only documents for declared parameters is added by hand
+QUERY_REQUEST_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {"application/json": {"schema": QueryRequest.model_json_schema()}},
+    },
+    "responses": {
+        "422": {
+            "description": "Validation Error",
+            "content": {
+                "application/json": {
+                    "schema": {
+                        "title": "HTTPValidationError",
+                        "type": "object",
+                        "properties": {
+                            "detail": {
+                                "title": "Detail",
+                                "type": "array",
+                                "items": validation_error_definition,
+                            }
+                        },
+                    }
+                }
+            },
+        }
+    },
+}
+
+
+class QueryPayload(TypedDict):
+    """Query request body as parsed by /api/query, without pydantic"""
+
+    query: str
+    session_id: NotRequired[str | None]
+
+
+def parse_query_payload(body: bytes) -> QueryPayload:
+    """
+    Decode a query request body, checking only the fields the handler reads.
+
+    Invalid bodies raise RequestValidationError, so they get FastAPI's standard 422 with
+    a list of {loc, msg, type} errors, as a QueryRequest parameter would.
+    """
+    try:
+        data = orjson.loads(body)
+    except orjson.JSONDecodeError as e:
+        # Same error FastAPI reports for a body it cannot decode
+        raise RequestValidationError(
+            [
+                {
+                    "type": "json_invalid",
+                    "loc": ("body", e.pos),
+                    "msg": "JSON decode error",
+                    "input": {},
+                    "ctx": {"error": e.msg},
+                }
+            ],
+            body=e.doc,
+        ) from e
+
+    if (
+        isinstance(data, dict)
+        and isinstance(data.get("query"), str)
+        and isinstance(data.get("session_id"), str | None)
+    ):
+        return data
+
+    # Only invalid bodies go through pydantic, which words the errors like FastAPI does
+    try:
+        QueryRequest.model_validate(data)
+    except ValidationError as e:
+        errors = [
+            {**error, "loc": ("body", *error["loc"])} for error in e.errors(include_url=False)
+        ]
+        raise RequestValidationError(errors, body=data) from e
+    raise AssertionError("unreachable: QueryRequest rejects every body the checks above do")
+
+
+async def query_event_stream(rag_system, query: str, session_id: str) -> AsyncIterator[bytes]:
+    """Server-sent events for a streamed query, ending with sources and session id"""
+    try:
+        async for event in rag_system.astream_query(query, session_id):
+            if event["type"] == "done":
+                event["session_id"] = session_id
+            yield b"data: " + orjson.dumps(event) + b"\n\n"
+    except Exception as e:
+        # Headers are already sent, so errors are reported in-band
+        yield b"data: " + orjson.dumps({"type": "error", "detail": str(e)}) + b"\n\n"
+
+
+@lru_cache(maxsize=1)
+def course_stats_body(rag_system, course_version: int) -> tuple[bytes, str]:
+    """Encoded /api/courses body and its ETag for one version of the course catalog"""
+    analytics = rag_system.get_course_analytics()
+    body = orjson.dumps(
+        {"total_courses": analytics["total_courses"], "course_titles": analytics["course_titles"]}
+    )
+    return body, f'"{hashlib.sha1(body).hexdigest()}"'
+
+
+def _etag_matches(if_none_match: str | None, etag: str) -> bool:
+    """
+    Whether an If-None-Match header matches etag.
+
+    The header may list several tags or be "*", and proxies may send the tag back weak
+    (W/"..."); If-None-Match uses weak comparison, so the W/ prefix is ignored.
+    """
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+    return any(tag.strip().removeprefix("W/") == etag for tag in if_none_match.split(","))
+
+
+async def course_stats_response(rag_system, if_none_match: str | None) -> Response:
+    """
+    /api/courses response for rag_system's catalog.
+
+    The analytics are re-read and re-encoded only when ingestion has changed the catalog
+    (course_version); a miss queries ChromaDB, so it runs off the event loop. Clients
+    revalidate with If-None-Match and get a 304 while the catalog is unchanged.
+    """
+    try:
+        body, etag = await asyncio.to_thread(
+            course_stats_body, rag_system, rag_system.course_version
+        )
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e)) from e
+
+    headers = {"ETag": etag, "Cache-Control": f"max-age={config.COURSES_CACHE_MAX_AGE}"}
+    if _etag_matches(if_none_match, etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
@@ -4,16 +4,25 @@ warnings.filterwarnings("ignore", message="resource_tracker: There appear to be.
 
 import os  # noqa: E402
 
+from api_helpers import (  # noqa: E402
+    QUERY_REQUEST_OPENAPI,
+    course_stats_response,
+    parse_query_payload,
+    query_event_stream,
+)
 from config import config  # noqa: E402
-from fastapi import FastAPI, HTTPException  # noqa: E402
+from fastapi import FastAPI, HTTPException, Request  # noqa: E402
 from fastapi.middleware.cors import CORSMiddleware  # noqa: E402
 from fastapi.middleware.trustedhost import TrustedHostMiddleware  # noqa: E402
+from fastapi.responses import ORJSONResponse, StreamingResponse  # noqa: E402
 from fastapi.staticfiles import StaticFiles  # noqa: E402
 from pydantic import BaseModel  # noqa: E402
 from rag_system import RAGSystem  # noqa: E402
 
-# Initialize FastAPI app
-app = FastAPI(title="Course Materials RAG System", root_path="")
+# Initialize FastAPI app; JSON responses are encoded with orjson
+app = FastAPI(
+    title="Course Materials RAG System", root_path="", default_response_class=ORJSONResponse
+)
 
 # Add trusted host middleware for proxy
 app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
@@ -33,13 +42,6 @@ rag_system = RAGSystem(config)
 
 
 # Pydantic models for request/response
-class QueryRequest(BaseModel):
-    """Request model for course queries"""
-
-    query: str
-    session_id: str | None = None
-
-
 class QueryResponse(BaseModel):
     """Response model for course queries"""
 
@@ -58,33 +60,46 @@ class CourseStats(BaseModel):
 # API Endpoints
 
 
-@app.post("/api/query", response_model=QueryResponse)
-async def query_documents(request: QueryRequest):
+# QueryRequest/QueryResponse only document the schema: the handler parses the body and
+# encodes the payload itself, skipping pydantic validation and jsonable_encoder
+@app.post(
+    "/api/query", responses={200: {"model": QueryResponse}}, openapi_extra=QUERY_REQUEST_OPENAPI
+)
+async def query_documents(request: Request):
     """Process a query and return response with sources"""
+    payload = parse_query_payload(await request.body())
     try:
         # Create session if not provided
-        session_id = request.session_id
+        session_id = payload.get("session_id")
         if not session_id:
             session_id = rag_system.session_manager.create_session()
 
         # Process query using RAG system
-        answer, sources = rag_system.query(request.query, session_id)
+        answer, sources = await rag_system.aquery(payload["query"], session_id)
 
-        return QueryResponse(answer=answer, sources=sources, session_id=session_id)
+        return ORJSONResponse({"answer": answer, "sources": sources, "session_id": session_id})
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e)) from e
 
 
-@app.get("/api/courses", response_model=CourseStats)
-async def get_course_stats():
+@app.post("/api/query/stream", openapi_extra=QUERY_REQUEST_OPENAPI)
+async def stream_query(request: Request):
+    """Stream the answer as server-sent events, ending with sources and session id"""
+    payload = parse_query_payload(await request.body())
+    session_id = payload.get("session_id")
+    if not session_id:
+        session_id = rag_system.session_manager.create_session()
+
+    return StreamingResponse(
+        query_event_stream(rag_system, payload["query"], session_id),
+        media_type="text/event-stream",
+    )
+
+
+@app.get("/api/courses", responses={200: {"model": CourseStats}})
+async def get_course_stats(request: Request):
     """Get course analytics and statistics"""
-    try:
-        analytics = rag_system.get_course_analytics()
-        return CourseStats(
-            total_courses=analytics["total_courses"], course_titles=analytics["course_titles"]
-        )
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e)) from e
+    return await course_stats_response(rag_system, request.headers.get("if-none-match"))
 
 
 @app.delete("/api/sessions/{session_id}")
@@ -14,6 +14,9 @@ class Config:
     # Anthropic API settings
     ANTHROPIC_API_KEY: str = os.getenv("ANTHROPIC_API_KEY", "")
     ANTHROPIC_MODEL: str = "claude-sonnet-4-20250514"
+    # Optional faster model (e.g. a Haiku tier) for rounds that only choose tools;
+    # empty means every round uses ANTHROPIC_MODEL
+    ANTHROPIC_ROUTER_MODEL: str = os.getenv("ANTHROPIC_ROUTER_MODEL", "")
 
     # Embedding model settings
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
@@ -24,6 +27,18 @@ class Config:
     MAX_RESULTS: int = 5  # Maximum search results to return
     MAX_HISTORY: int = 2  # Number of conversation messages to remember
     MAX_TOOL_ROUNDS: int = 2  # Maximum sequential tool call rounds per query
+    BATCH_POLL_INTERVAL: float = 10.0  # Seconds between Message Batches status checks
+    CONNECT_TIMEOUT: float = 5.0  # Seconds to establish a connection to the Anthropic API
+    REQUEST_TIMEOUT: float = 60.0  # Seconds allowed for a request that must produce the answer
+    TOOL_ROUND_TIMEOUT: float = 30.0  # Seconds allowed for a round that may still call tools
+
+    # Anthropic HTTP connection pool (shared by all AIGenerator instances)
+    HTTP_MAX_CONNECTIONS: int = 200  # Concurrent connections to the Anthropic API
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 100  # Idle connections kept open for reuse
+    HTTP_KEEPALIVE_EXPIRY: float = 30.0  # Seconds an idle connection stays in the pool
+
+    # API response caching
+    COURSES_CACHE_MAX_AGE: int = 60  # Seconds clients may reuse a /api/courses response
 
     # Database paths
     CHROMA_PATH: str = "./chroma_db"  # ChromaDB storage location
@@ -1,6 +1,8 @@
 import os
+from collections.abc import AsyncIterator
+from typing import Any
 
-from ai_generator import AIGenerator
+from ai_generator import AIGenerator, run_sync
 from document_processor import DocumentProcessor
 from models import Course
 from search_tools import CourseOutlineTool, CourseSearchTool, ToolManager
@@ -19,8 +21,9 @@ class RAGSystem:
         self.vector_store = VectorStore(
             config.CHROMA_PATH, config.EMBEDDING_MODEL, config.MAX_RESULTS
         )
-        self.ai_generator = AIGenerator(config.ANTHROPIC_API_KEY, config.ANTHROPIC_MODEL)
         self.session_manager = SessionManager(config.MAX_HISTORY)
+        # Bumped whenever the course catalog changes, so cached analytics can be invalidated
+        self.course_version = 0
 
         # Initialize search tools
         self.tool_manager = ToolManager()
@@ -29,6 +32,14 @@ class RAGSystem:
         self.outline_tool = CourseOutlineTool(self.vector_store)
         self.tool_manager.register_tool(self.outline_tool)
 
+        # Tool definitions are fixed, so the generator receives them once
+        self.ai_generator = AIGenerator(
+            config.ANTHROPIC_API_KEY,
+            config.ANTHROPIC_MODEL,
+            tools=self.tool_manager.get_tool_definitions(),
+            router_model=config.ANTHROPIC_ROUTER_MODEL,
+        )
+
     def add_course_document(self, file_path: str) -> tuple[Course, int]:
         """
         Add a single course document to the knowledge base.
@@ -48,6 +59,7 @@ class RAGSystem:
 
             # Add course content chunks to vector store
             self.vector_store.add_course_content(course_chunks)
+            self.course_version += 1
 
             return course, len(course_chunks)
         except Exception as e:
@@ -72,6 +84,7 @@ class RAGSystem:
         if clear_existing:
             print("Clearing existing data for fresh rebuild...")
             self.vector_store.clear_all_data()
+            self.course_version += 1
 
         if not os.path.exists(folder_path):
             print(f"Folder {folder_path} does not exist")
@@ -104,9 +117,18 @@ class RAGSystem:
                 except Exception as e:
                     print(f"Error processing {file_name}: {e}")
 
+        if total_courses:
+            self.course_version += 1
+
         return total_courses, total_chunks
 
     def query(self, query: str, session_id: str | None = None) -> tuple[str, list[str]]:
+        """
+        Synchronous wrapper around aquery() for callers without an event loop.
+        """
+        return run_sync(self.aquery(query, session_id))
+
+    async def aquery(self, query: str, session_id: str | None = None) -> tuple[str, list[str]]:
         """
         Process a user query using the RAG system with tool-based search.
 
@@ -123,22 +145,18 @@ class RAGSystem:
         # Get conversation history if session exists
         history = None
         if session_id:
-            history = self.session_manager.get_conversation_history(session_id)
+            history = self.session_manager.get_history_messages(session_id)
 
-        # Generate response using AI with tools
-        response = self.ai_generator.generate_response(
+        # Generate response using AI with tools; sources are collected for this query only,
+        # since concurrent queries share the tool manager
+        sources = []
+        response = await self.ai_generator.agenerate_response(
             query=prompt,
-            conversation_history=history,
-            tools=self.tool_manager.get_tool_definitions(),
+            history_messages=history,
             tool_manager=self.tool_manager,
+            sources=sources,
         )
 
-        # Get sources from the search tool
-        sources = self.tool_manager.get_last_sources()
-
-        # Reset sources after retrieving them
-        self.tool_manager.reset_sources()
-
         # Update conversation history
         if session_id:
             self.session_manager.add_exchange(session_id, query, response)
@@ -146,6 +164,43 @@ class RAGSystem:
         # Return response with sources from tool searches
         return response, sources
 
+    async def astream_query(
+        self, query: str, session_id: str | None = None
+    ) -> AsyncIterator[dict[str, Any]]:
+        """
+        Process a user query, streaming the answer as it is generated.
+
+        Args:
+            query: User's question
+            session_id: Optional session ID for conversation context
+
+        Yields:
+            {"type": "text", "text": chunk} events while the answer is generated, then one
+            {"type": "done", "sources": [...]} event once it is complete
+        """
+        prompt = f"""Answer this question about course materials: {query}"""
+
+        history = None
+        if session_id:
+            history = self.session_manager.get_history_messages(session_id)
+
+        chunks = []
+        sources = []
+        async for text in self.ai_generator.astream_response(
+            query=prompt,
+            history_messages=history,
+            tool_manager=self.tool_manager,
+            sources=sources,
+        ):
+            chunks.append(text)
+            yield {"type": "text", "text": text}
+
+        # History only records the answer once it has been streamed in full
+        if session_id:
+            self.session_manager.add_exchange(session_id, query, "".join(chunks))
+
+        yield {"type": "done", "sources": sources}
+
     def get_course_analytics(self) -> dict:
         """Get analytics about the course catalog"""
         return {
@@ -1,3 +1,4 @@
+import asyncio
 import json
 from abc import ABC, abstractmethod
 from typing import Any
@@ -18,6 +19,15 @@ class Tool(ABC):
         """Execute the tool with given parameters"""
         pass
 
+    def execute_with_sources(self, **kwargs) -> tuple[str, list]:
+        """
+        Execute the tool and return its result with the sources it used.
+
+        Unlike execute(), this leaves last_sources alone, so concurrent calls on a shared
+        tool cannot overwrite each other's sources. Tools without sources return [].
+        """
+        return self.execute(**kwargs), []
+
 
 class CourseSearchTool(Tool):
     """Tool for searching course content with semantic course name matching"""
@@ -65,7 +75,18 @@ class CourseSearchTool(Tool):
         Returns:
             Formatted search results or error message
         """
+        result, sources = self.execute_with_sources(
+            query=query, course_name=course_name, lesson_number=lesson_number
+        )
+        # Store sources for retrieval; searches without results keep the previous ones
+        if sources:
+            self.last_sources = sources
+        return result
 
+    def execute_with_sources(
+        self, query: str, course_name: str | None = None, lesson_number: int | None = None
+    ) -> tuple[str, list]:
+        """Search like execute(), returning the sources instead of storing them"""
         # Use the vector store's unified search interface
         results = self.store.search(
             query=query, course_name=course_name, lesson_number=lesson_number
@@ -73,7 +94,7 @@ class CourseSearchTool(Tool):
 
         # Handle errors
         if results.error:
-            return results.error
+            return results.error, []
 
         # Handle empty results
         if results.is_empty():
@@ -82,12 +103,12 @@ class CourseSearchTool(Tool):
                 filter_info += f" in course '{course_name}'"
             if lesson_number:
                 filter_info += f" in lesson {lesson_number}"
-            return f"No relevant content found{filter_info}."
+            return f"No relevant content found{filter_info}.", []
 
         # Format and return results
         return self._format_results(results)
 
-    def _format_results(self, results: SearchResults) -> str:
+    def _format_results(self, results: SearchResults) -> tuple[str, list]:
         """Format search results with course and lesson context"""
         formatted = []
         sources = []  # Track sources for the UI
@@ -127,10 +148,7 @@ class CourseSearchTool(Tool):
 
             formatted.append(f"{header}\n{doc}")
 
-        # Store sources for retrieval
-        self.last_sources = sources
-
-        return "\n\n".join(formatted)
+        return "\n\n".join(formatted), sources
 
 
 class CourseOutlineTool(Tool):
@@ -157,16 +175,22 @@ class CourseOutlineTool(Tool):
         }
 
     def execute(self, course_name: str) -> str:
+        result, sources = self.execute_with_sources(course_name=course_name)
+        if sources:
+            self.last_sources = sources
+        return result
+
+    def execute_with_sources(self, course_name: str) -> tuple[str, list]:
         # Step 1: Use semantic search to resolve course name to exact title
         try:
             results = self.store.course_catalog.query(query_texts=[course_name], n_results=1)
 
             if not results["documents"][0] or not results["metadatas"][0]:
-                return f"No course found matching '{course_name}'"
+                return f"No course found matching '{course_name}'", []
 
             metadata = results["metadatas"][0][0]
         except Exception as e:
-            return f"Error finding course: {str(e)}"
+            return f"Error finding course: {str(e)}", []
 
         # Step 2: Extract course info
         course_title = metadata.get("title", "Unknown")
@@ -195,15 +219,15 @@ class CourseOutlineTool(Tool):
         else:
             output_lines.append("  No lessons found")
 
-        # Step 5: Track source for UI
-        self.last_sources = [
+        # Step 5: Source for UI
+        sources = [
             {
                 "display_text": course_title,
                 "url": course_link if course_link != "No link available" else None,
             }
         ]
 
-        return "\n".join(output_lines)
+        return "\n".join(output_lines), sources
 
 
 class ToolManager:
@@ -231,6 +255,22 @@ class ToolManager:
 
         return self.tools[tool_name].execute(**kwargs)
 
+    def execute_tool_with_sources(self, tool_name: str, **kwargs) -> tuple[str, list]:
+        """Execute a tool by name, returning its result and sources without storing them"""
+        if tool_name not in self.tools:
+            return f"Tool '{tool_name}' not found", []
+
+        return self.tools[tool_name].execute_with_sources(**kwargs)
+
+    async def aexecute_tool(self, tool_name: str, **kwargs) -> tuple[str, list]:
+        """
+        Execute a tool by name in a worker thread so blocking searches don't stall the loop.
+
+        Returns the result together with that call's sources. Several calls may run at once
+        on the same tools, so nothing is written to last_sources.
+        """
+        return await asyncio.to_thread(self.execute_tool_with_sources, tool_name, **kwargs)
+
     def get_last_sources(self) -> list:
         """Get sources from the last search operation"""
         # Check all tools for last_sources attribute
@@ -57,6 +57,27 @@ class SessionManager:
 
         return "\n".join(formatted_messages)
 
+    def get_history_messages(self, session_id: str | None) -> list[dict[str, str]] | None:
+        """Get conversation history as alternating user/assistant API messages"""
+        if not session_id or session_id not in self.sessions:
+            return None
+
+        messages = self.sessions[session_id]
+        if not messages:
+            return None
+
+        # An exchange whose answer came back empty is left out: the API rejects empty
+        # content, and sending it would fail every later request in the session
+        history = []
+        for msg in messages:
+            if msg.role == "assistant" and not msg.content:
+                if history and history[-1]["role"] == "user":
+                    history.pop()
+                continue
+            history.append({"role": msg.role, "content": msg.content})
+
+        return history or None
+
     def clear_session(self, session_id: str):
         """Clear all messages from a session"""
         if session_id in self.sessions:
@@ -1,20 +1,117 @@
 """Shared fixtures for RAG chatbot tests"""
 
-import os
-import sys
-from unittest.mock import MagicMock
-
+import itertools
+from dataclasses import dataclass, field
+from functools import lru_cache
+from types import SimpleNamespace
+from typing import Any
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import ai_generator
 import pytest
+from pydantic import BaseModel
+from vector_store import SearchResults
 
-# Add backend to path for imports
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-from vector_store import SearchResults
+def pytest_sessionstart(session):
+    """Stop the run up front if MAX_RESULTS=0, since every search would come back empty"""
+    from config import config
+
+    if config.MAX_RESULTS == 0:
+        pytest.exit("MAX_RESULTS=0 - fix config before running the test suite", returncode=1)
+
+
+@pytest.fixture(scope="session", autouse=True)
+def _mock_anthropic():
+    """Never build a real SDK client; tests needing a specific client patch over this"""
+    with patch("anthropic.AsyncAnthropic", new=MagicMock):
+        yield
+
+
+@pytest.fixture(autouse=True)
+def _reset_anthropic_client_cache():
+    """Drop cached clients so each test's patched AsyncAnthropic is picked up"""
+    ai_generator._clients.clear()
+    yield
+    ai_generator._clients.clear()
+
+
+@dataclass(frozen=True)
+class FakeBlock:
+    """Plain stand-in for an anthropic content block; the code only reads attributes"""
+
+    type: str
+    text: str = ""
+    name: str = ""
+    id: str = ""
+    input: dict[str, Any] = field(default_factory=dict)
+
+
+@dataclass(frozen=True)
+class FakeResponse:
+    """Plain stand-in for an anthropic Message response"""
+
+    stop_reason: str
+    content: list[FakeBlock]
+
+
+class ScriptedCall:
+    """
+    Plain stand-in for a client method: replays scripted results and records calls.
+
+    Exposes the subset of the Mock API the tests use (call_args, call_args_list,
+    call_count, side_effect, assert_called_once) without MagicMock's attribute machinery.
+    A single scripted result answers every call; otherwise one result per call.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.side_effect = None
+        self.call_args_list = []
+
+    def __call__(self, **kwargs):
+        self.call_args_list.append(SimpleNamespace(kwargs=kwargs))
+        if self.side_effect is not None:
+            raise self.side_effect
+        if len(self.results) == 1:
+            return self.results[0]
+        return self.results[self.call_count - 1]
+
+    @property
+    def call_count(self):
+        return len(self.call_args_list)
+
+    @property
+    def call_args(self):
+        return self.call_args_list[-1] if self.call_args_list else None
+
+    def assert_called_once(self):
+        assert self.call_count == 1, f"Expected 1 call, got {self.call_count}"
+
+
+class AsyncScriptedCall(ScriptedCall):
+    """ScriptedCall for coroutine methods such as messages.create"""
+
+    async def __call__(self, **kwargs):
+        return super().__call__(**kwargs)
+
+    assert_awaited_once = ScriptedCall.assert_called_once
+
+
+def _messages_of(client, call_index=-1):
+    """The messages list sent on one messages.create call of a scripted client (default: last)"""
+    return client.messages.create.call_args_list[call_index].kwargs["messages"]
 
 
 @pytest.fixture
+def messages_of():
+    """Helper that pulls the messages sent on a given messages.create call"""
+    return _messages_of
+
+
+@pytest.fixture(scope="session")
 def sample_search_results():
-    """Realistic SearchResults data for testing"""
+    """Realistic SearchResults data for testing; the search tools only read it, so one per run"""
     return SearchResults(
         documents=[
             "Course Introduction content: This lesson covers the basics of machine learning.",
@@ -30,75 +127,290 @@ def sample_search_results():
     )
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def empty_search_results():
     """Empty results for edge case testing"""
     return SearchResults(documents=[], metadata=[], distances=[])
 
 
-@pytest.fixture
+@pytest.fixture(scope="session")
 def error_search_results():
     """Results with error message"""
     return SearchResults.empty("Search error: Database connection failed")
 
 
+@lru_cache(maxsize=32)
+def _make_results(documents, metadata, distances):
+    """SearchResults built once per distinct input; metadata rows are (title, lesson, chunk) tuples"""
+    return SearchResults(
+        documents=list(documents),
+        metadata=[
+            {
+                "course_title": course_title,
+                "lesson_number": lesson_number,
+                "chunk_index": chunk_index,
+            }
+            for course_title, lesson_number, chunk_index in metadata
+        ],
+        distances=list(distances),
+    )
+
+
 @pytest.fixture
-def mock_vector_store(sample_search_results):
-    """Mocked VectorStore with configurable results"""
-    mock_store = MagicMock()
-    mock_store.search.return_value = sample_search_results
-    mock_store.get_course_link.return_value = "https://example.com/course"
-    mock_store.get_lesson_link.return_value = "https://example.com/course/lesson1"
-    return mock_store
+def make_search_results():
+    """Cached SearchResults factory keyed on tuple inputs"""
+    return _make_results
+
+
+class StubVectorStore:
+    """
+    Plain stand-in for VectorStore as the search tools use it.
+
+    search() records its kwargs and returns `results`; the link lookups return fixed URLs.
+    Cheaper than MagicMock, which every search tool test goes through.
+    """
+
+    __slots__ = ("results", "search_calls", "lesson_link_calls")
+
+    COURSE_LINK = "https://example.com/course"
+    LESSON_LINK = "https://example.com/course/lesson1"
+
+    def __init__(self, results=None):
+        self.reset(results)
+
+    def reset(self, results):
+        self.results = results
+        self.search_calls = []
+        self.lesson_link_calls = []
+
+    def search(self, **kwargs):
+        self.search_calls.append(kwargs)
+        return self.results
+
+    def get_course_link(self, course_title):
+        return self.COURSE_LINK
+
+    def get_lesson_link(self, course_title, lesson_number):
+        self.lesson_link_calls.append((course_title, lesson_number))
+        return self.LESSON_LINK
+
+
+@pytest.fixture(scope="session")
+def _session_vector_store():
+    """One VectorStore stub for the whole run; mock_vector_store resets it per test"""
+    return StubVectorStore()
 
 
 @pytest.fixture
-def mock_anthropic_client():
-    """Mocked Anthropic client (no real API calls)"""
-    mock_client = MagicMock()
+def mock_vector_store(request, _session_vector_store):
+    """
+    Stub VectorStore with no calls left from earlier tests.
+
+    Returns sample_search_results unless parametrized indirectly with the name of another
+    results fixture, e.g. parametrize("mock_vector_store", ["empty_search_results"], indirect=True).
+    """
+    results = request.getfixturevalue(getattr(request, "param", "sample_search_results"))
+    _session_vector_store.reset(results)
+    return _session_vector_store
 
-    # Create a mock response for non-tool-use case
-    mock_response = MagicMock()
-    mock_response.stop_reason = "end_turn"
-    mock_response.content = [MagicMock(text="This is a test response about machine learning.")]
 
-    mock_client.messages.create.return_value = mock_response
-    return mock_client
+@pytest.fixture(scope="session")
+def _session_search_tools(_session_vector_store):
+    """A CourseSearchTool on the shared VectorStore mock, registered with a ToolManager"""
+    from search_tools import CourseSearchTool, ToolManager
+
+    tool = CourseSearchTool(_session_vector_store)
+    manager = ToolManager()
+    manager.register_tool(tool)
+    return tool, manager
 
 
 @pytest.fixture
-def mock_anthropic_client_with_tool_use():
-    """Mocked Anthropic client that triggers tool use"""
-    mock_client = MagicMock()
-
-    # Create tool use response
-    tool_use_block = MagicMock()
-    tool_use_block.type = "tool_use"
-    tool_use_block.name = "search_course_content"
-    tool_use_block.id = "tool_123"
-    tool_use_block.input = {"query": "machine learning basics"}
-
-    initial_response = MagicMock()
-    initial_response.stop_reason = "tool_use"
-    initial_response.content = [tool_use_block]
-
-    # Create final response after tool execution
-    final_response = MagicMock()
-    final_response.stop_reason = "end_turn"
-    final_response.content = [
-        MagicMock(text="Based on the course materials, machine learning is...")
+def search_tool(_session_search_tools, mock_vector_store):
+    """Shared CourseSearchTool on mock_vector_store, with no sources left from earlier tests"""
+    tool, _ = _session_search_tools
+    tool.last_sources = []
+    return tool
+
+
+@pytest.fixture
+def search_tool_manager(_session_search_tools, search_tool):
+    """Shared ToolManager holding only search_tool"""
+    _, manager = _session_search_tools
+    return manager
+
+
+@pytest.fixture(scope="module")
+def tool_definition(_session_search_tools):
+    """CourseSearchTool's tool definition; it never changes, so build it once per module"""
+    tool, _ = _session_search_tools
+    return tool.get_tool_definition()
+
+
+def _scripted_responses(script):
+    """
+    Build the responses for a script of (stop_reason, payload) steps, one per call.
+
+    ("tool_use", {"name", "id", "input"}) - or a list of those for parallel tool calls,
+    where plain strings become text blocks - or ("end_turn", text).
+    """
+    responses = []
+    for stop_reason, payload in script:
+        if stop_reason == "tool_use":
+            tool_calls = payload if isinstance(payload, list) else [payload]
+            content = [
+                FakeBlock(type="text", text=call)
+                if isinstance(call, str)
+                else FakeBlock(type="tool_use", **call)
+                for call in tool_calls
+            ]
+        else:
+            content = [FakeBlock(type="text", text=payload)]
+        responses.append(FakeResponse(stop_reason=stop_reason, content=content))
+    return tuple(responses)
+
+
+def _scripted_client(responses):
+    """Mocked AsyncAnthropic client whose messages.create replays the given responses"""
+    return SimpleNamespace(messages=SimpleNamespace(create=AsyncScriptedCall(responses)))
+
+
+# Scripts for the shared client fixtures, built once at import; the frozen responses are
+# safe to share because the generator only reads them
+_TEXT_RESPONSES = _scripted_responses(
+    [("end_turn", "This is a test response about machine learning.")]
+)
+
+_TOOL_USE_RESPONSES = _scripted_responses(
+    [
+        (
+            "tool_use",
+            {
+                "name": "search_course_content",
+                "id": "tool_123",
+                "input": {"query": "machine learning basics"},
+            },
+        ),
+        ("end_turn", "Based on the course materials, machine learning is..."),
+    ]
+)
+
+_DOUBLE_TOOL_USE_RESPONSES = _scripted_responses(
+    [
+        (
+            "tool_use",
+            {
+                "name": "search_course_content",
+                "id": "tool_123",
+                "input": {"query": "machine learning basics"},
+            },
+        ),
+        (
+            "tool_use",
+            {
+                "name": "search_course_content",
+                "id": "tool_456",
+                "input": {"query": "deep learning advanced"},
+            },
+        ),
+        (
+            "end_turn",
+            "Comparing ML and DL: Machine learning covers basics while deep learning "
+            "uses neural networks.",
+        ),
     ]
+)
+
+# First MAX_TOOL_ROUNDS calls return tool_use, then final call returns end_turn
+_ALWAYS_TOOL_USE_RESPONSES = _scripted_responses(
+    [
+        *(
+            (
+                "tool_use",
+                {
+                    "name": "search_course_content",
+                    "id": f"tool_{call_num}",
+                    "input": {"query": f"query {call_num}"},
+                },
+            )
+            for call_num in (1, 2)
+        ),
+        ("end_turn", "Final answer after max rounds reached."),
+    ]
+)
+
+
+@pytest.fixture
+def build_mock_anthropic():
+    """
+    Factory for mocked AsyncAnthropic clients driven by a response script.
+
+    See _scripted_responses for the script format. A one-step script answers every
+    call with the same response.
+    """
 
-    # First call returns tool_use, second returns final answer
-    mock_client.messages.create.side_effect = [initial_response, final_response]
+    def _build(script):
+        return _scripted_client(_scripted_responses(script))
 
-    return mock_client
+    return _build
 
 
 @pytest.fixture
-def mock_tool_manager():
-    """Mocked ToolManager"""
+def make_generator():
+    """Factory for AIGenerators backed by a given mocked client"""
+    from ai_generator import AIGenerator
+
+    def _make(client, model="claude-test", **kwargs):
+        generator = AIGenerator(api_key="test_key", model=model, **kwargs)
+        generator.client = client
+        return generator
+
+    return _make
+
+
+@pytest.fixture(scope="module")
+def _module_generator():
+    """One default AIGenerator per test module; `generator` swaps in each test's client"""
+    from ai_generator import AIGenerator
+
+    return AIGenerator(api_key="test_key", model="claude-test")
+
+
+@pytest.fixture
+def generator(_module_generator, mock_anthropic_client):
+    """Shared AIGenerator (model "claude-test", no default tools) on mock_anthropic_client"""
+    _module_generator.client = mock_anthropic_client
+    return _module_generator
+
+
+@pytest.fixture
+def mock_anthropic_client():
+    """Mocked AsyncAnthropic client (no real API calls)"""
+    return _scripted_client(_TEXT_RESPONSES)
+
+
+@pytest.fixture
+def mock_anthropic_client_with_tool_use():
+    """Mocked Anthropic client that triggers tool use"""
+    return _scripted_client(_TOOL_USE_RESPONSES)
+
+
+@pytest.fixture(scope="session")
+def _session_tool_manager():
+    """One ToolManager mock for the whole run; mock_tool_manager resets it per test"""
     mock_manager = MagicMock()
+    # Async entry point delegates to execute_tool, with no sources, so call assertions stay
+    # in one place
+    mock_manager.aexecute_tool = AsyncMock()
+    return mock_manager
+
+
+@pytest.fixture
+def mock_tool_manager(_session_tool_manager):
+    """Mocked ToolManager, reset to its default behaviour for each test"""
+    mock_manager = _session_tool_manager
+    mock_manager.reset_mock(return_value=True, side_effect=True)
+
     mock_manager.get_tool_definitions.return_value = [
         {
             "name": "search_course_content",
@@ -111,6 +423,10 @@ def mock_tool_manager():
         }
     ]
     mock_manager.execute_tool.return_value = "Search results: Machine learning content..."
+    mock_manager.aexecute_tool.side_effect = lambda name, **kwargs: (
+        mock_manager.execute_tool(name, **kwargs),
+        [],
+    )
     mock_manager.get_last_sources.return_value = [
         {"display_text": "Machine Learning Basics - Lesson 1", "url": "https://example.com/ml"}
     ]
@@ -132,128 +448,174 @@ def sample_course_metadata():
 @pytest.fixture
 def mock_anthropic_client_with_double_tool_use():
     """Mocked Anthropic client that triggers tool use twice before final response"""
-    mock_client = MagicMock()
-
-    # Create first tool use response
-    tool_use_block_1 = MagicMock()
-    tool_use_block_1.type = "tool_use"
-    tool_use_block_1.name = "search_course_content"
-    tool_use_block_1.id = "tool_123"
-    tool_use_block_1.input = {"query": "machine learning basics"}
-
-    first_response = MagicMock()
-    first_response.stop_reason = "tool_use"
-    first_response.content = [tool_use_block_1]
-
-    # Create second tool use response
-    tool_use_block_2 = MagicMock()
-    tool_use_block_2.type = "tool_use"
-    tool_use_block_2.name = "search_course_content"
-    tool_use_block_2.id = "tool_456"
-    tool_use_block_2.input = {"query": "deep learning advanced"}
-
-    second_response = MagicMock()
-    second_response.stop_reason = "tool_use"
-    second_response.content = [tool_use_block_2]
-
-    # Create final response after both tool executions
-    final_response = MagicMock()
-    final_response.stop_reason = "end_turn"
-    final_response.content = [
-        MagicMock(
-            text="Comparing ML and DL: Machine learning covers basics while deep learning uses neural networks."
-        )
-    ]
-
-    # First call returns tool_use, second returns tool_use, third returns final answer
-    mock_client.messages.create.side_effect = [first_response, second_response, final_response]
-
-    return mock_client
+    return _scripted_client(_DOUBLE_TOOL_USE_RESPONSES)
 
 
 @pytest.fixture
 def mock_anthropic_client_always_tool_use():
     """Mocked Anthropic client that always returns tool_use (for testing max rounds)"""
-    mock_client = MagicMock()
-
-    def create_tool_use_response(call_num):
-        tool_use_block = MagicMock()
-        tool_use_block.type = "tool_use"
-        tool_use_block.name = "search_course_content"
-        tool_use_block.id = f"tool_{call_num}"
-        tool_use_block.input = {"query": f"query {call_num}"}
-
-        response = MagicMock()
-        response.stop_reason = "tool_use"
-        response.content = [tool_use_block]
-        return response
-
-    # Create final response for when tools are removed
-    final_response = MagicMock()
-    final_response.stop_reason = "end_turn"
-    final_response.content = [MagicMock(text="Final answer after max rounds reached.")]
-
-    # First MAX_TOOL_ROUNDS calls return tool_use, then final call returns end_turn
-    mock_client.messages.create.side_effect = [
-        create_tool_use_response(1),
-        create_tool_use_response(2),
-        final_response,
-    ]
+    return _scripted_client(_ALWAYS_TOOL_USE_RESPONSES)
+
+
+class FakeMessageStream:
+    """Async context manager standing in for anthropic's AsyncMessageStream"""
+
+    def __init__(self, chunks, final_message):
+        self.chunks = chunks
+        self.final_message = final_message
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        return False
+
+    @property
+    async def text_stream(self):
+        for chunk in self.chunks:
+            yield chunk
+
+    async def get_final_message(self):
+        return self.final_message
+
+
+@pytest.fixture
+def mock_anthropic_client_streaming():
+    """Mocked Anthropic client whose stream() does one tool round, then streams text"""
+    tool_use_block = FakeBlock(
+        type="tool_use",
+        name="search_course_content",
+        id="tool_123",
+        input={"query": "machine learning basics"},
+    )
+    tool_message = FakeResponse(stop_reason="tool_use", content=[tool_use_block])
 
-    return mock_client
+    final_message = FakeResponse(
+        stop_reason="end_turn",
+        content=[FakeBlock(type="text", text="Machine learning is a subset of AI.")],
+    )
+
+    stream = ScriptedCall(
+        [
+            FakeMessageStream([], tool_message),
+            FakeMessageStream(["Machine learning ", "is a subset of AI."], final_message),
+        ]
+    )
+
+    return SimpleNamespace(messages=SimpleNamespace(stream=stream))
 
 
 # ============================================================================
 # API Testing Fixtures
 # ============================================================================
 
+
+# Default RAGSystem results, built once; the endpoints only read them
+_DEFAULT_QUERY_RESPONSE = (
+    "This is a test response.",
+    [{"display_text": "Test Course", "url": "https://example.com"}],
+)
+_DEFAULT_COURSE_ANALYTICS = {"total_courses": 2, "course_titles": ["Course 1", "Course 2"]}
+_course_versions = itertools.count()
+
+
+async def _stream_events(query, session_id):
+    """Default astream_query script: two text deltas, then the done event"""
+    yield {"type": "text", "text": "This is "}
+    yield {"type": "text", "text": "a test response."}
+    yield {"type": "done", "sources": []}
+
+
+@pytest.fixture(scope="session")
+def _session_rag_system():
+    """One RAGSystem mock for the whole run; mock_rag_system resets it per test"""
+    from rag_system import RAGSystem
+    from session_manager import SessionManager
+
+    # Specs limit the mocks to the real attribute names; the children the endpoint
+    # handlers call (create_session, clear_session, aquery, astream_query and
+    # get_course_analytics) are created here, up front, rather than lazily in a test
+    mock_rag = MagicMock(spec=RAGSystem)
+    mock_rag.session_manager = MagicMock(spec=SessionManager)
+    mock_rag.session_manager.create_session = MagicMock()
+    mock_rag.session_manager.clear_session = MagicMock()
+    mock_rag.aquery = AsyncMock()
+    mock_rag.astream_query = MagicMock()
+    mock_rag.get_course_analytics = MagicMock()
+    return mock_rag
+
+
 @pytest.fixture
-def mock_rag_system():
-    """Mocked RAGSystem for API testing"""
-    mock_rag = MagicMock()
+def mock_rag_system(_session_rag_system):
+    """Mocked RAGSystem for API testing, reset to its default behaviour for each test"""
+    mock_rag = _session_rag_system
+    mock_rag.reset_mock(return_value=True, side_effect=True)
 
     # Mock session manager
-    mock_rag.session_manager = MagicMock()
     mock_rag.session_manager.create_session.return_value = "test_session_123"
     mock_rag.session_manager.clear_session.return_value = None
 
     # Mock query method
-    mock_rag.query.return_value = (
-        "This is a test response.",
-        [{"display_text": "Test Course", "url": "https://example.com"}]
-    )
+    mock_rag.aquery.return_value = _DEFAULT_QUERY_RESPONSE
+
+    # Mock streaming query method
+    mock_rag.astream_query.side_effect = _stream_events
 
     # Mock analytics method
-    mock_rag.get_course_analytics.return_value = {
-        "total_courses": 2,
-        "course_titles": ["Course 1", "Course 2"]
-    }
+    mock_rag.get_course_analytics.return_value = _DEFAULT_COURSE_ANALYTICS
+    # A fresh catalog version per test, so cached /api/courses responses never carry over
+    mock_rag.course_version = next(_course_versions)
 
     return mock_rag
 
 
-@pytest.fixture
-def test_app(mock_rag_system):
+# Response models (same as app.py), defined once at import
+class QueryResponse(BaseModel):
+    """Response model for course queries"""
+
+    answer: str
+    sources: list[dict[str, str | None]]
+    session_id: str
+
+
+class CourseStats(BaseModel):
+    """Response model for course statistics"""
+
+    total_courses: int
+    course_titles: list[str]
+
+
+@pytest.fixture(scope="session")
+def test_app():
     """
     Create a test FastAPI app without static file mounting.
 
     This avoids the issue where app.py mounts ../frontend directory
     which doesn't exist in the test environment.
+
+    Built once per session; endpoints read the RAG system from app.state.rag_system,
+    which test_client points at each test's mock_rag_system.
     """
-    from fastapi import FastAPI, HTTPException
+    from api_helpers import (
+        QUERY_REQUEST_OPENAPI,
+        course_stats_response,
+        parse_query_payload,
+        query_event_stream,
+    )
+    from fastapi import FastAPI, HTTPException, Request
     from fastapi.middleware.cors import CORSMiddleware
     from fastapi.middleware.trustedhost import TrustedHostMiddleware
-    from pydantic import BaseModel
-    from typing import List, Optional, Dict
+    from fastapi.responses import ORJSONResponse, StreamingResponse
 
     # Create test app with same configuration as production
-    app = FastAPI(title="Course Materials RAG System (Test)", root_path="")
+    app = FastAPI(
+        title="Course Materials RAG System (Test)",
+        root_path="",
+        default_response_class=ORJSONResponse,
+    )
 
     # Add same middleware as production
-    app.add_middleware(
-        TrustedHostMiddleware,
-        allowed_hosts=["*"]
-    )
+    app.add_middleware(TrustedHostMiddleware, allowed_hosts=["*"])
 
     app.add_middleware(
         CORSMiddleware,
@@ -264,59 +626,77 @@ def test_app(mock_rag_system):
         expose_headers=["*"],
     )
 
-    # Pydantic models (same as app.py)
-    class QueryRequest(BaseModel):
-        query: str
-        session_id: Optional[str] = None
-
-    class QueryResponse(BaseModel):
-        answer: str
-        sources: List[Dict[str, Optional[str]]]
-        session_id: str
-
-    class CourseStats(BaseModel):
-        total_courses: int
-        course_titles: List[str]
-
-    # Define API endpoints inline (same logic as app.py but using mock_rag_system)
-    @app.post("/api/query", response_model=QueryResponse)
-    async def query_documents(request: QueryRequest):
+    # Define API endpoints inline (same logic as app.py but using the per-test mock)
+    @app.post(
+        "/api/query",
+        responses={200: {"model": QueryResponse}},
+        openapi_extra=QUERY_REQUEST_OPENAPI,
+    )
+    async def query_documents(request: Request):
+        rag_system = app.state.rag_system
+        payload = parse_query_payload(await request.body())
         try:
-            session_id = request.session_id
+            session_id = payload.get("session_id")
             if not session_id:
-                session_id = mock_rag_system.session_manager.create_session()
+                session_id = rag_system.session_manager.create_session()
 
-            answer, sources = mock_rag_system.query(request.query, session_id)
+            answer, sources = await rag_system.aquery(payload["query"], session_id)
 
-            return QueryResponse(
-                answer=answer,
-                sources=sources,
-                session_id=session_id
-            )
+            return ORJSONResponse({"answer": answer, "sources": sources, "session_id": session_id})
         except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+            raise HTTPException(status_code=500, detail=str(e)) from e
+
+    @app.post("/api/query/stream", openapi_extra=QUERY_REQUEST_OPENAPI)
+    async def stream_query(request: Request):
+        rag_system = app.state.rag_system
+        payload = parse_query_payload(await request.body())
+        session_id = payload.get("session_id")
+        if not session_id:
+            session_id = rag_system.session_manager.create_session()
+
+        return StreamingResponse(
+            query_event_stream(rag_system, payload["query"], session_id),
+            media_type="text/event-stream",
+        )
 
-    @app.get("/api/courses", response_model=CourseStats)
-    async def get_course_stats():
-        try:
-            analytics = mock_rag_system.get_course_analytics()
-            return CourseStats(
-                total_courses=analytics["total_courses"],
-                course_titles=analytics["course_titles"]
-            )
-        except Exception as e:
-            raise HTTPException(status_code=500, detail=str(e))
+    @app.get("/api/courses", responses={200: {"model": CourseStats}})
+    async def get_course_stats(request: Request):
+        return await course_stats_response(
+            app.state.rag_system, request.headers.get("if-none-match")
+        )
 
     @app.delete("/api/sessions/{session_id}")
     async def clear_session(session_id: str):
-        mock_rag_system.session_manager.clear_session(session_id)
+        app.state.rag_system.session_manager.clear_session(session_id)
         return {"status": "cleared", "session_id": session_id}
 
     return app
 
 
+@pytest.fixture(scope="session")
+def anyio_backend():
+    """Run the anyio-marked API tests on asyncio, like the app itself"""
+    return "asyncio"
+
+
+@pytest.fixture(scope="session")
+async def _session_test_client(test_app, anyio_backend):
+    """
+    One async client shared by every API test, closed when the session ends.
+
+    Requests go straight into the app over httpx's in-process ASGI transport, on the
+    test's own event loop, instead of through TestClient's portal thread.
+    """
+    import httpx
+
+    async with httpx.AsyncClient(
+        transport=httpx.ASGITransport(app=test_app), base_url="http://testserver"
+    ) as client:
+        yield client
+
+
 @pytest.fixture
-def test_client(test_app):
-    """FastAPI TestClient for API endpoint testing"""
-    from fastapi.testclient import TestClient
-    return TestClient(test_app)
+def test_client(test_app, _session_test_client, mock_rag_system):
+    """Async HTTP client for API endpoint testing, serving this test's mock_rag_system"""
+    test_app.state.rag_system = mock_rag_system
+    return _session_test_client
@@ -1,359 +1,859 @@
 """Tests for AIGenerator.
 
-Tests the generate_response() method at line 49 with mocked Anthropic client.
+Tests generate_response(), the synchronous wrapper around agenerate_response(), and the
+streaming and batch entry points with a mocked Anthropic client.
 """
 
+import asyncio
+import logging
 import os
+import subprocess
 import sys
-from unittest.mock import MagicMock, patch
-
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
-from ai_generator import AIGenerator
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest.mock import AsyncMock, MagicMock, patch
+
+import anthropic
+import httpx
+import orjson
+import pytest
+from ai_generator import AIGenerator, _new_client
+from config import config
+
+# The real client class, captured at collection before conftest patches it for the session
+_REAL_ASYNC_ANTHROPIC = anthropic.AsyncAnthropic
+
+# Shared tool definitions; the generator copies rather than mutates them
+_TOOLS_MIN = ({"name": "search_course_content", "description": "Search"},)
+_TOOLS_FULL = (
+    {
+        "name": "search_course_content",
+        "description": "Search course materials",
+        "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}},
+    },
+)
 
 
 class TestAIGeneratorBasicResponse:
     """Test basic response generation without tools"""
 
-    def test_generate_response_without_tools(self, mock_anthropic_client):
+    def test_generate_response_without_tools(self, generator, mock_anthropic_client):
         """Basic response without tool usage"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
+        response = generator.generate_response(query="What is Python?")
 
-            response = generator.generate_response(query="What is Python?")
+        assert response == "This is a test response about machine learning."
+        mock_anthropic_client.messages.create.assert_called_once()
 
-            assert response == "This is a test response about machine learning."
-            mock_anthropic_client.messages.create.assert_called_once()
+    def test_agenerate_response_awaits_client(self, generator, mock_anthropic_client):
+        """Async entry point awaits the AsyncAnthropic client"""
+        response = asyncio.run(generator.agenerate_response(query="What is Python?"))
 
-    def test_generate_response_includes_query(self, mock_anthropic_client):
-        """Query is passed to the API"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
+        assert response == "This is a test response about machine learning."
+        mock_anthropic_client.messages.create.assert_awaited_once()
 
-            generator.generate_response(query="Explain neural networks")
+    def test_generate_response_includes_query(self, messages_of, generator, mock_anthropic_client):
+        """Query is passed to the API"""
+        generator.generate_response(query="Explain neural networks")
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            messages = call_args.kwargs["messages"]
-            assert len(messages) == 1
-            assert messages[0]["role"] == "user"
-            assert "Explain neural networks" in messages[0]["content"]
+        messages = messages_of(mock_anthropic_client)
+        assert len(messages) == 1
+        assert messages[0]["role"] == "user"
+        assert "Explain neural networks" in messages[0]["content"]
 
-    def test_generate_response_uses_system_prompt(self, mock_anthropic_client):
+    def test_generate_response_uses_system_prompt(self, generator, mock_anthropic_client):
         """System prompt is included in API call"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
+        generator.generate_response(query="test query")
+
+        system = mock_anthropic_client.messages.create.call_args.kwargs["system"]
+        prompt_lower = system[0]["text"].lower()
+        assert "course materials" in prompt_lower or "educational" in prompt_lower
+
+    def test_system_prompt_is_cache_breakpoint(self, generator, mock_anthropic_client):
+        """Static system prompt block is marked for prompt caching"""
+        history = [
+            {"role": "user", "content": "hi"},
+            {"role": "assistant", "content": "Hello!"},
+        ]
+        generator.generate_response(query="test query", history_messages=history)
 
-            generator.generate_response(query="test query")
+        system = mock_anthropic_client.messages.create.call_args.kwargs["system"]
+        assert system[0]["text"] == AIGenerator.SYSTEM_PROMPT
+        assert system[0]["cache_control"] == {"type": "ephemeral"}
+        # History never reaches the system prompt, so it is identical for every session
+        assert len(system) == 1
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            system = call_args.kwargs["system"]
-            assert "course materials" in system.lower() or "educational" in system.lower()
+    def test_system_blocks_shared_across_calls(self, generator, mock_anthropic_client):
+        """System blocks are built once, not per request"""
+        generator.generate_response(query="first")
+        generator.generate_response(query="second")
+
+        first, second = mock_anthropic_client.messages.create.call_args_list
+        assert first.kwargs["system"] is second.kwargs["system"]
 
 
 class TestAIGeneratorWithHistory:
     """Test response generation with conversation history"""
 
-    def test_generate_response_with_history(self, mock_anthropic_client):
-        """History is included in system prompt"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            history = "User: What is ML?\nAssistant: Machine Learning is..."
+    def test_generate_response_with_history(self, messages_of, generator, mock_anthropic_client):
+        """History is sent as prior messages ahead of the query"""
+        history = [
+            {"role": "user", "content": "What is ML?"},
+            {"role": "assistant", "content": "Machine Learning is..."},
+        ]
 
-            generator.generate_response(query="Tell me more", conversation_history=history)
+        generator.generate_response(query="Tell me more", history_messages=history)
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            system = call_args.kwargs["system"]
-            assert "Previous conversation" in system
-            assert history in system
+        messages = messages_of(mock_anthropic_client)
+        assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+        assert messages[0] == {"role": "user", "content": "What is ML?"}
+        assert messages[-1] == {"role": "user", "content": "Tell me more"}
 
-    def test_generate_response_without_history(self, mock_anthropic_client):
-        """No history results in base system prompt only"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
+    def test_latest_history_turn_is_cache_breakpoint(
+        self, messages_of, generator, mock_anthropic_client
+    ):
+        """The previous answer carries the breakpoint; the caller's history is not mutated"""
+        history = [
+            {"role": "user", "content": "What is ML?"},
+            {"role": "assistant", "content": "Machine Learning is..."},
+        ]
+
+        generator.generate_response(query="Tell me more", history_messages=history)
+
+        messages = messages_of(mock_anthropic_client)
+        assert messages[1]["content"] == [
+            {
+                "type": "text",
+                "text": "Machine Learning is...",
+                "cache_control": {"type": "ephemeral"},
+            }
+        ]
+        assert history[1] == {"role": "assistant", "content": "Machine Learning is..."}
+
+    def test_empty_history_turn_gets_no_breakpoint(
+        self, messages_of, generator, mock_anthropic_client
+    ):
+        """An empty latest turn is not turned into an (invalid) empty text block"""
+        history = [
+            {"role": "user", "content": "What is ML?"},
+            {"role": "assistant", "content": ""},
+        ]
+
+        generator.generate_response(query="Tell me more", history_messages=history)
 
-            generator.generate_response(query="test", conversation_history=None)
+        assert messages_of(mock_anthropic_client)[1] == {"role": "assistant", "content": ""}
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            system = call_args.kwargs["system"]
-            assert "Previous conversation" not in system
+    def test_generate_response_without_history(self, messages_of, generator, mock_anthropic_client):
+        """No history results in the query as the only message"""
+        generator.generate_response(query="test", history_messages=None)
+
+        assert messages_of(mock_anthropic_client) == [{"role": "user", "content": "test"}]
 
 
 class TestAIGeneratorWithTools:
     """Test response generation with tools"""
 
-    def test_generate_response_passes_tools(self, mock_anthropic_client):
+    def test_generate_response_passes_tools(self, generator, mock_anthropic_client):
         """Tools are passed to API when provided"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [
-                {
-                    "name": "search_course_content",
-                    "description": "Search course materials",
-                    "input_schema": {"type": "object", "properties": {"query": {"type": "string"}}},
-                }
-            ]
+        generator.generate_response(query="test", tools=_TOOLS_FULL)
 
-            generator.generate_response(query="test", tools=tools)
+        call_args = mock_anthropic_client.messages.create.call_args
+        assert "tools" in call_args.kwargs
+        sent_tools = call_args.kwargs["tools"]
+        assert [t["name"] for t in sent_tools] == ["search_course_content"]
+        assert sent_tools[-1]["cache_control"] == {"type": "ephemeral"}
+        # Caller's definitions are not mutated
+        assert "cache_control" not in _TOOLS_FULL[0]
+        assert call_args.kwargs["tool_choice"] == {"type": "auto"}
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            assert "tools" in call_args.kwargs
-            assert call_args.kwargs["tools"] == tools
-            assert call_args.kwargs["tool_choice"] == {"type": "auto"}
+    def test_constructor_tools_used_by_default(self, make_generator, mock_anthropic_client):
+        """Tools given at construction are sent when no per-call tools are passed"""
+        generator = make_generator(mock_anthropic_client, tools=_TOOLS_MIN)
 
-    def test_generate_response_without_tools_no_tool_params(self, mock_anthropic_client):
-        """No tools means no tool parameters in API call"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
+        generator.generate_response(query="test")
+        generator.generate_response(query="test again")
+
+        first, second = mock_anthropic_client.messages.create.call_args_list
+        assert first.kwargs["tools"][0]["name"] == "search_course_content"
+        # The prepared definitions and tool_choice are reused, not rebuilt per call
+        assert first.kwargs["tools"] is second.kwargs["tools"]
+        assert first.kwargs["tool_choice"] is AIGenerator._TOOL_CHOICE_AUTO
 
-            generator.generate_response(query="test", tools=None)
+    def test_empty_tools_overrides_constructor_tools(self, make_generator, mock_anthropic_client):
+        """Passing tools=[] disables the constructor's tools for that call"""
+        generator = make_generator(mock_anthropic_client, tools=_TOOLS_MIN)
+
+        generator.generate_response(query="test", tools=[])
+
+        assert "tools" not in mock_anthropic_client.messages.create.call_args.kwargs
+
+    def test_generate_response_without_tools_no_tool_params(self, generator, mock_anthropic_client):
+        """No tools means no tool parameters in API call"""
+        generator.generate_response(query="test", tools=None)
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            assert "tools" not in call_args.kwargs
+        call_args = mock_anthropic_client.messages.create.call_args
+        assert "tools" not in call_args.kwargs
 
 
 class TestAIGeneratorToolExecution:
     """Test tool execution flow"""
 
-    def test_handle_tool_execution(self, mock_anthropic_client_with_tool_use, mock_tool_manager):
+    def test_handle_tool_execution(
+        self, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
+    ):
         """Tool calls are executed correctly"""
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_with_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_tool_use)
 
-            response = generator.generate_response(
-                query="What is machine learning?", tools=tools, tool_manager=mock_tool_manager
-            )
+        response = generator.generate_response(
+            query="What is machine learning?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Tool manager should have been called
-            mock_tool_manager.execute_tool.assert_called_once()
-            # Final response should be returned
-            assert "machine learning" in response.lower()
+        # Tool manager should have been called
+        mock_tool_manager.execute_tool.assert_called_once()
+        # Final response should be returned
+        assert "machine learning" in response.lower()
 
     def test_tool_results_formatted_correctly(
-        self, mock_anthropic_client_with_tool_use, mock_tool_manager
+        self, messages_of, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
     ):
         """Tool results are formatted correctly for follow-up"""
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_with_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_tool_use)
 
-            generator.generate_response(
-                query="test query", tools=tools, tool_manager=mock_tool_manager
-            )
+        generator.generate_response(
+            query="test query", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Check second API call (follow-up after tool execution)
-            assert mock_anthropic_client_with_tool_use.messages.create.call_count == 2
-            second_call = mock_anthropic_client_with_tool_use.messages.create.call_args_list[1]
-            messages = second_call.kwargs["messages"]
+        # Check second API call (follow-up after tool execution)
+        assert mock_anthropic_client_with_tool_use.messages.create.call_count == 2
+        messages = messages_of(mock_anthropic_client_with_tool_use, 1)
 
-            # Should have user message, assistant tool_use, and user tool_result
-            assert len(messages) == 3
-            assert messages[2]["role"] == "user"
-            # Tool results are in a list
-            tool_results = messages[2]["content"]
-            assert isinstance(tool_results, list)
-            assert tool_results[0]["type"] == "tool_result"
+        # Should have user message, assistant tool_use, and user tool_result
+        assert len(messages) == 3
+        assert messages[2]["role"] == "user"
+        # Tool results are in a list
+        tool_results = messages[2]["content"]
+        assert isinstance(tool_results, list)
+        assert tool_results[0]["type"] == "tool_result"
 
     def test_final_response_after_tools(
-        self, mock_anthropic_client_with_tool_use, mock_tool_manager
+        self, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
     ):
         """Returns synthesized answer after tool execution"""
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_with_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
-
-            response = generator.generate_response(
-                query="test query", tools=tools, tool_manager=mock_tool_manager
-            )
-
-            # Should return the final response text
-            assert response == "Based on the course materials, machine learning is..."
+        generator = make_generator(mock_anthropic_client_with_tool_use)
+
+        response = generator.generate_response(
+            query="test query", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        # Should return the final response text
+        assert response == "Based on the course materials, machine learning is..."
+
+
+class _MessagesHandler(BaseHTTPRequestHandler):
+    """Answers every POST with a fixed Messages API response over keep-alive HTTP/1.1"""
+
+    protocol_version = "HTTP/1.1"
+    BODY = orjson.dumps(
+        {
+            "id": "msg_1",
+            "type": "message",
+            "role": "assistant",
+            "model": "claude-test",
+            "content": [{"type": "text", "text": "Local answer"}],
+            "stop_reason": "end_turn",
+            "stop_sequence": None,
+            "usage": {"input_tokens": 1, "output_tokens": 1},
+        }
+    )
+
+    def do_POST(self):
+        self.rfile.read(int(self.headers["Content-Length"]))
+        self.server.request_count += 1
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(self.BODY)))
+        self.end_headers()
+        self.wfile.write(self.BODY)
+
+    def log_message(self, format, *args):
+        pass
+
+
+@contextmanager
+def _local_messages_server():
+    """Serve _MessagesHandler on a free local port for the duration of the block"""
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _MessagesHandler)
+    server.request_count = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    try:
+        yield server
+    finally:
+        server.shutdown()
+        server.server_close()
 
 
 class TestAIGeneratorConfiguration:
     """Test AIGenerator configuration"""
 
-    def test_uses_provided_model(self, mock_anthropic_client):
-        """Generator uses the provided model"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="claude-custom-model")
+    @pytest.mark.parametrize(
+        ("key", "expected"),
+        [
+            ("model", "claude-custom-model"),  # The provided model is used
+            ("temperature", 0),  # Deterministic responses
+            ("max_tokens", 800),
+        ],
+    )
+    def test_request_uses_configured_parameter(
+        self, make_generator, mock_anthropic_client, key, expected
+    ):
+        """Generator passes its configured parameters to the API"""
+        generator = make_generator(mock_anthropic_client, model="claude-custom-model")
 
-            generator.generate_response(query="test")
+        generator.generate_response(query="test")
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            assert call_args.kwargs["model"] == "claude-custom-model"
+        assert mock_anthropic_client.messages.create.call_args.kwargs[key] == expected
 
-    def test_uses_configured_temperature(self, mock_anthropic_client):
-        """Generator uses temperature 0 for deterministic responses"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="test-model")
+    def test_client_shared_per_api_key_and_event_loop(self):
+        """Generators with the same API key reuse one pooled client within an event loop"""
+        first = AIGenerator(api_key="key_a", model="test-model")
+        second = AIGenerator(api_key="key_a", model="other-model")
+        third = AIGenerator(api_key="key_b", model="test-model")
 
-            generator.generate_response(query="test")
+        async def clients():
+            return first.client, second.client, third.client
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            assert call_args.kwargs["temperature"] == 0
+        with patch("anthropic.AsyncAnthropic", side_effect=lambda **_: MagicMock()):
+            first_loop = asyncio.run(clients())
+            second_loop = asyncio.run(clients())
 
-    def test_uses_configured_max_tokens(self, mock_anthropic_client):
-        """Generator uses configured max tokens"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            generator = AIGenerator(api_key="test_key", model="test-model")
+        assert first_loop[0] is first_loop[1]
+        assert first_loop[0] is not first_loop[2]
+        # Pooled connections belong to the loop that opened them
+        assert first_loop[0] is not second_loop[0]
 
-            generator.generate_response(query="test")
+    def test_sync_calls_do_not_reuse_connections_from_closed_loops(self, caplog, monkeypatch):
+        """Back-to-back generate_response() calls over a real transport succeed first time"""
+        with (
+            _local_messages_server() as server,
+            patch("anthropic.AsyncAnthropic", new=_REAL_ASYNC_ANTHROPIC),
+            caplog.at_level(logging.INFO, logger="anthropic"),
+        ):
+            monkeypatch.setenv("ANTHROPIC_BASE_URL", f"http://127.0.0.1:{server.server_port}")
+            generator = AIGenerator(api_key="test_key", model="claude-test")
 
-            call_args = mock_anthropic_client.messages.create.call_args
-            assert call_args.kwargs["max_tokens"] == 800
+            answers = [generator.generate_response(query="test") for _ in range(2)]
 
+        assert answers == ["Local answer", "Local answer"]
+        assert server.request_count == 2
+        # A pooled connection from the first call's closed loop would fail and be retried
+        assert not [r for r in caplog.records if "Retrying" in r.getMessage()]
 
-class TestAIGeneratorSystemPrompt:
-    """Test system prompt content"""
+    def test_client_encodes_request_bodies_with_orjson(self):
+        """Request bodies are serialised by orjson and still sent as JSON"""
+        with patch("anthropic.AsyncAnthropic") as client_cls:
+            _new_client("test_key")
 
-    def test_system_prompt_contains_key_instructions(self):
-        """System prompt has required instruction elements"""
-        prompt = AIGenerator.SYSTEM_PROMPT
+            http_client = client_cls.call_args.kwargs["http_client"]
+            body = {"messages": [{"role": "user", "content": "héllo"}]}
+            request = http_client.build_request(
+                "POST", "https://api.anthropic.com/v1/messages", json=body
+            )
+
+            assert request.content == orjson.dumps(body)
+            assert request.headers["content-type"] == "application/json"
+
+    def test_module_import_does_not_load_anthropic(self):
+        """The SDK is only imported once a client is created"""
+        backend_dir = os.path.join(os.path.dirname(__file__), "..")
+        result = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                "import sys, ai_generator; print('anthropic' in sys.modules)",
+            ],
+            cwd=backend_dir,
+            capture_output=True,
+            text=True,
+            check=True,
+        )
+
+        assert result.stdout.strip() == "False"
+
+    def test_client_uses_http2_pool_sized_from_config(self):
+        """The shared client multiplexes over an HTTP/2 pool sized by config"""
+        with (
+            patch("anthropic.AsyncAnthropic") as client_cls,
+            patch("httpx.AsyncHTTPTransport", wraps=httpx.AsyncHTTPTransport) as transport_cls,
+        ):
+            _new_client("test_key")
 
-        # Should mention tool usage
-        assert "search" in prompt.lower() or "tool" in prompt.lower()
-        # Should mention educational/course context
-        assert "course" in prompt.lower() or "educational" in prompt.lower()
-        # Should mention conciseness
-        assert "concise" in prompt.lower() or "brief" in prompt.lower()
+            transport_kwargs = transport_cls.call_args.kwargs
+            assert transport_kwargs["http2"] is True
+            limits = transport_kwargs["limits"]
+            assert limits.max_connections == config.HTTP_MAX_CONNECTIONS
+            assert limits.max_keepalive_connections == config.HTTP_MAX_KEEPALIVE_CONNECTIONS
+            assert limits.keepalive_expiry == config.HTTP_KEEPALIVE_EXPIRY
+            assert client_cls.call_args.kwargs["http_client"] is not None
 
-    def test_system_prompt_mentions_search_limit(self):
-        """System prompt mentions search limit per query"""
-        prompt = AIGenerator.SYSTEM_PROMPT
 
-        assert "2 searches" in prompt.lower() or "maximum" in prompt.lower()
+class TestAIGeneratorSystemPrompt:
+    """Test system prompt content"""
+
+    PROMPT_LOWER = AIGenerator.SYSTEM_PROMPT.lower()
+
+    @pytest.mark.parametrize(
+        "needles",
+        [
+            ("search", "tool"),  # Should mention tool usage
+            ("course", "educational"),  # Should mention educational/course context
+            ("concise", "brief"),  # Should mention conciseness
+            ("2 searches", "maximum"),  # Should mention the search limit per query
+        ],
+    )
+    def test_system_prompt_contains_key_instructions(self, needles):
+        """System prompt has required instruction elements"""
+        assert any(needle in self.PROMPT_LOWER for needle in needles)
 
 
 class TestAIGeneratorMultiRoundToolExecution:
     """Test multi-round tool execution flow"""
 
     def test_two_sequential_tool_calls(
-        self, mock_anthropic_client_with_double_tool_use, mock_tool_manager
+        self, make_generator, mock_anthropic_client_with_double_tool_use, mock_tool_manager
     ):
         """Claude makes 2 tool calls in sequence"""
-        with patch(
-            "ai_generator.anthropic.Anthropic",
-            return_value=mock_anthropic_client_with_double_tool_use,
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_double_tool_use)
 
-            response = generator.generate_response(
-                query="Compare ML and DL courses", tools=tools, tool_manager=mock_tool_manager
-            )
+        response = generator.generate_response(
+            query="Compare ML and DL courses", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Should have 3 API calls: first tool_use, second tool_use, final answer
-            assert mock_anthropic_client_with_double_tool_use.messages.create.call_count == 3
-            # Tool manager should have been called twice
-            assert mock_tool_manager.execute_tool.call_count == 2
-            # Should return the final response
-            assert "Comparing ML and DL" in response
+        # Should have 3 API calls: first tool_use, second tool_use, final answer
+        assert mock_anthropic_client_with_double_tool_use.messages.create.call_count == 3
+        # Tool manager should have been called twice
+        assert mock_tool_manager.execute_tool.call_count == 2
+        # Should return the final response
+        assert "Comparing ML and DL" in response
 
     def test_single_tool_call_when_sufficient(
-        self, mock_anthropic_client_with_tool_use, mock_tool_manager
+        self, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
     ):
         """Claude stops after 1 tool call when sufficient"""
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_with_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_tool_use)
 
-            response = generator.generate_response(
-                query="What is machine learning?", tools=tools, tool_manager=mock_tool_manager
-            )
+        response = generator.generate_response(
+            query="What is machine learning?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Should have 2 API calls: first tool_use, then final answer
-            assert mock_anthropic_client_with_tool_use.messages.create.call_count == 2
-            # Tool manager should have been called once
-            assert mock_tool_manager.execute_tool.call_count == 1
-            assert "machine learning" in response.lower()
+        # Should have 2 API calls: first tool_use, then final answer
+        assert mock_anthropic_client_with_tool_use.messages.create.call_count == 2
+        # Tool manager should have been called once
+        assert mock_tool_manager.execute_tool.call_count == 1
+        assert "machine learning" in response.lower()
 
-    def test_max_rounds_enforced(self, mock_anthropic_client_always_tool_use, mock_tool_manager):
+    def test_max_rounds_enforced(
+        self, make_generator, mock_anthropic_client_always_tool_use, mock_tool_manager
+    ):
         """Loop stops at MAX_TOOL_ROUNDS and final call has no tools"""
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_always_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_always_tool_use)
 
-            response = generator.generate_response(
-                query="Keep searching forever", tools=tools, tool_manager=mock_tool_manager
-            )
+        response = generator.generate_response(
+            query="Keep searching forever", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Should have 3 API calls: 2 tool_use rounds + 1 final without tools
-            assert mock_anthropic_client_always_tool_use.messages.create.call_count == 3
+        # Should have 3 API calls: 2 tool_use rounds + 1 final without tools
+        assert mock_anthropic_client_always_tool_use.messages.create.call_count == 3
 
-            # Final call should NOT have tools parameter
-            final_call = mock_anthropic_client_always_tool_use.messages.create.call_args_list[2]
-            assert "tools" not in final_call.kwargs
+        # Final call should NOT have tools parameter
+        final_call = mock_anthropic_client_always_tool_use.messages.create.call_args_list[2]
+        assert "tools" not in final_call.kwargs
+        assert "tool_choice" not in final_call.kwargs
+        # Popping tools for the final round leaves the shared template untouched
+        assert generator.base_params == {
+            "model": "claude-test",
+            "temperature": 0,
+            "max_tokens": 800,
+        }
 
-            # Should return the final forced response
-            assert "Final answer after max rounds reached" in response
+        # Should return the final forced response
+        assert "Final answer after max rounds reached" in response
 
     def test_message_accumulation(
-        self, mock_anthropic_client_with_double_tool_use, mock_tool_manager
+        self,
+        messages_of,
+        make_generator,
+        mock_anthropic_client_with_double_tool_use,
+        mock_tool_manager,
     ):
         """Messages grow correctly with each round"""
-        with patch(
-            "ai_generator.anthropic.Anthropic",
-            return_value=mock_anthropic_client_with_double_tool_use,
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_double_tool_use)
+
+        generator.generate_response(
+            query="Compare courses", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        # Check the third (final) API call has accumulated messages
+        messages = messages_of(mock_anthropic_client_with_double_tool_use, 2)
+
+        # Should have 5 messages:
+        # [0] user: original query
+        # [1] assistant: tool_use block 1
+        # [2] user: tool_result 1
+        # [3] assistant: tool_use block 2
+        # [4] user: tool_result 2
+        assert len(messages) == 5
+        assert messages[0]["role"] == "user"
+        assert messages[1]["role"] == "assistant"
+        assert messages[2]["role"] == "user"
+        assert messages[3]["role"] == "assistant"
+        assert messages[4]["role"] == "user"
+
+    def test_cache_breakpoint_moves_to_latest_tool_result(
+        self,
+        messages_of,
+        make_generator,
+        mock_anthropic_client_with_double_tool_use,
+        mock_tool_manager,
+    ):
+        """Only the newest tool_result carries the conversation cache breakpoint"""
+        generator = make_generator(mock_anthropic_client_with_double_tool_use)
 
-            generator.generate_response(
-                query="Compare courses", tools=tools, tool_manager=mock_tool_manager
-            )
+        generator.generate_response(
+            query="Compare courses", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
 
-            # Check the third (final) API call has accumulated messages
-            third_call = mock_anthropic_client_with_double_tool_use.messages.create.call_args_list[
-                2
-            ]
-            messages = third_call.kwargs["messages"]
-
-            # Should have 5 messages:
-            # [0] user: original query
-            # [1] assistant: tool_use block 1
-            # [2] user: tool_result 1
-            # [3] assistant: tool_use block 2
-            # [4] user: tool_result 2
-            assert len(messages) == 5
-            assert messages[0]["role"] == "user"
-            assert messages[1]["role"] == "assistant"
-            assert messages[2]["role"] == "user"
-            assert messages[3]["role"] == "assistant"
-            assert messages[4]["role"] == "user"
-
-    def test_tool_error_continues(self, mock_anthropic_client_with_tool_use):
+        messages = messages_of(mock_anthropic_client_with_double_tool_use)
+        assert "cache_control" not in messages[2]["content"][-1]
+        assert messages[4]["content"][-1]["cache_control"] == {"type": "ephemeral"}
+
+    def test_tool_error_continues(
+        self, messages_of, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
+    ):
         """Tool execution error is passed to Claude as tool result"""
-        mock_tool_manager = MagicMock()
         mock_tool_manager.execute_tool.side_effect = Exception("Database connection failed")
 
-        with patch(
-            "ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client_with_tool_use
-        ):
-            generator = AIGenerator(api_key="test_key", model="claude-test")
-            tools = [{"name": "search_course_content", "description": "Search"}]
+        generator = make_generator(mock_anthropic_client_with_tool_use)
 
+        generator.generate_response(
+            query="Search something", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        # Check second API call contains the error in tool_result
+        messages = messages_of(mock_anthropic_client_with_tool_use, 1)
+
+        # The tool result message
+        tool_result_msg = messages[2]["content"]
+        assert isinstance(tool_result_msg, list)
+        assert "Tool execution error: Database connection failed" in tool_result_msg[0]["content"]
+
+    def test_parallel_tool_calls_in_one_round(
+        self, messages_of, make_generator, build_mock_anthropic, mock_tool_manager
+    ):
+        """Multiple tool_use blocks in one response all run and keep their order"""
+        tool_calls = [
+            {"name": "search_course_content", "id": tool_id, "input": {"query": query}}
+            for tool_id, query in (("tool_a", "ML basics"), ("tool_b", "DL basics"))
+        ]
+        mock_anthropic_client = build_mock_anthropic(
+            [("tool_use", tool_calls), ("end_turn", "ML and DL compared.")]
+        )
+        mock_tool_manager.execute_tool.side_effect = lambda name, query: f"results for {query}"
+
+        generator = make_generator(mock_anthropic_client)
+
+        generator.generate_response(
+            query="Compare ML and DL", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        assert mock_tool_manager.execute_tool.call_count == 2
+        tool_results = messages_of(mock_anthropic_client, 1)[2]["content"]
+        assert [r["tool_use_id"] for r in tool_results] == ["tool_a", "tool_b"]
+        assert [r["content"] for r in tool_results] == [
+            "results for ML basics",
+            "results for DL basics",
+        ]
+
+    def test_parallel_tool_calls_keep_their_own_sources(
+        self, make_generator, build_mock_anthropic, mock_tool_manager
+    ):
+        """Each concurrent call's sources are collected, in block order, whichever ends last"""
+        tool_calls = [
+            {"name": "search_course_content", "id": tool_id, "input": {"query": query}}
+            for tool_id, query in (("tool_a", "ML basics"), ("tool_b", "DL basics"))
+        ]
+        mock_anthropic_client = build_mock_anthropic(
+            [("tool_use", tool_calls), ("end_turn", "ML and DL compared.")]
+        )
+
+        async def search(name, query):
+            # The first call finishes last
+            await asyncio.sleep(0.01 if query == "ML basics" else 0)
+            return f"results for {query}", [{"display_text": query, "url": None}]
+
+        mock_tool_manager.aexecute_tool.side_effect = search
+        generator = make_generator(mock_anthropic_client)
+        sources = []
+
+        generator.generate_response(
+            query="Compare ML and DL",
+            tools=_TOOLS_MIN,
+            tool_manager=mock_tool_manager,
+            sources=sources,
+        )
+
+        assert [s["display_text"] for s in sources] == ["ML basics", "DL basics"]
+
+    def test_cancelled_tool_call_propagates(
+        self, make_generator, mock_anthropic_client_with_tool_use, mock_tool_manager
+    ):
+        """A cancelled tool call cancels the query instead of becoming a tool result"""
+        mock_tool_manager.aexecute_tool.side_effect = asyncio.CancelledError
+        generator = make_generator(mock_anthropic_client_with_tool_use)
+
+        with pytest.raises(asyncio.CancelledError):
             generator.generate_response(
-                query="Search something", tools=tools, tool_manager=mock_tool_manager
+                query="Search something", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
             )
 
-            # Check second API call contains the error in tool_result
-            second_call = mock_anthropic_client_with_tool_use.messages.create.call_args_list[1]
-            messages = second_call.kwargs["messages"]
+        assert mock_anthropic_client_with_tool_use.messages.create.call_count == 1
 
-            # The tool result message
-            tool_result_msg = messages[2]["content"]
-            assert isinstance(tool_result_msg, list)
-            assert (
-                "Tool execution error: Database connection failed" in tool_result_msg[0]["content"]
-            )
+
+class TestAIGeneratorMixedContent:
+    """Test responses that interleave text and tool_use blocks"""
+
+    TOOL_CALL = {"name": "search_course_content", "id": "tool_1", "input": {"query": "ML"}}
+
+    def test_text_joined_when_tool_use_cannot_run(self, make_generator, build_mock_anthropic):
+        """Without a tool manager the text blocks are the answer, even after a tool_use block"""
+        mock_anthropic_client = build_mock_anthropic(
+            [("tool_use", [self.TOOL_CALL, "Machine learning ", "learns from data."])]
+        )
+        generator = make_generator(mock_anthropic_client)
+
+        response = generator.generate_response(query="What is ML?")
+
+        assert response == "Machine learning learns from data."
+
+    def test_tool_use_alongside_text_still_runs_tools(
+        self, make_generator, build_mock_anthropic, mock_tool_manager
+    ):
+        """A partial answer with a tool call continues to the next round"""
+        mock_anthropic_client = build_mock_anthropic(
+            [
+                ("tool_use", ["Let me check the course.", self.TOOL_CALL]),
+                ("end_turn", "Final answer"),
+            ]
+        )
+        generator = make_generator(mock_anthropic_client)
+
+        response = generator.generate_response(
+            query="What is ML?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        assert response == "Final answer"
+        mock_tool_manager.execute_tool.assert_called_once_with("search_course_content", query="ML")
+
+
+class TestAIGeneratorRouterModel:
+    """Test routing tool-selection rounds to a separate model"""
+
+    TOOL_CALL = {"name": "search_course_content", "id": "tool_1", "input": {"query": "ML"}}
+
+    def test_router_picks_tools_and_main_model_answers(
+        self, make_generator, build_mock_anthropic, mock_tool_manager
+    ):
+        """Tool rounds run on the router model, the answer on the configured model"""
+        mock_anthropic_client = build_mock_anthropic(
+            [
+                ("tool_use", self.TOOL_CALL),
+                ("end_turn", "Router draft"),
+                ("end_turn", "Final answer"),
+            ]
+        )
+        generator = make_generator(mock_anthropic_client, router_model="claude-router")
+
+        response = generator.generate_response(
+            query="What is ML?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        assert response == "Final answer"
+        calls = mock_anthropic_client.messages.create.call_args_list
+        assert [call.kwargs["model"] for call in calls] == [
+            "claude-router",
+            "claude-router",
+            "claude-test",
+        ]
+        assert "tools" in calls[1].kwargs
+        assert "tools" not in calls[2].kwargs
+
+    def test_without_router_model_answer_is_not_reissued(
+        self, make_generator, build_mock_anthropic, mock_tool_manager
+    ):
+        """By default every round uses the configured model and a direct answer is final"""
+        mock_anthropic_client = build_mock_anthropic([("end_turn", "Direct answer")])
+        generator = make_generator(mock_anthropic_client)
+
+        response = generator.generate_response(
+            query="What is 2+2?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        assert response == "Direct answer"
+        create = mock_anthropic_client.messages.create
+        assert create.call_count == 1
+        assert create.call_args.kwargs["model"] == "claude-test"
+
+
+class TestAIGeneratorTimeouts:
+    """Test per-request timeouts and graceful degradation on timeout"""
+
+    @staticmethod
+    def _timeout_error():
+        return anthropic.APITimeoutError(
+            request=httpx.Request("POST", "https://api.anthropic.com/v1/messages")
+        )
+
+    def test_tool_rounds_use_shorter_timeout(
+        self, make_generator, mock_anthropic_client_always_tool_use, mock_tool_manager
+    ):
+        """Rounds that offer tools get the tool-round budget, the forced answer the full one"""
+        generator = make_generator(mock_anthropic_client_always_tool_use)
+
+        generator.generate_response(query="test", tools=_TOOLS_MIN, tool_manager=mock_tool_manager)
+
+        calls = mock_anthropic_client_always_tool_use.messages.create.call_args_list
+        timeouts = [call.kwargs["timeout"] for call in calls]
+        assert [timeout.read for timeout in timeouts] == [
+            config.TOOL_ROUND_TIMEOUT,
+            config.TOOL_ROUND_TIMEOUT,
+            config.REQUEST_TIMEOUT,
+        ]
+        # The connect limit survives the per-request override instead of taking its budget
+        assert {timeout.connect for timeout in timeouts} == {config.CONNECT_TIMEOUT}
+
+    def test_timeout_returns_canned_message(self, generator, mock_anthropic_client):
+        """An API timeout degrades to a message instead of raising"""
+        mock_anthropic_client.messages.create.side_effect = self._timeout_error()
+        response = generator.generate_response(query="test")
+
+        assert response == AIGenerator.TIMEOUT_MESSAGE
+
+    def test_stream_timeout_yields_canned_message(
+        self, make_generator, mock_anthropic_client_streaming
+    ):
+        """A streamed answer that times out ends with the canned message"""
+        mock_anthropic_client_streaming.messages.stream.side_effect = self._timeout_error()
+        generator = make_generator(mock_anthropic_client_streaming)
+
+        async def collect():
+            return [chunk async for chunk in generator.astream_response(query="test")]
+
+        assert asyncio.run(collect()) == [AIGenerator.TIMEOUT_MESSAGE]
+
+
+class TestAIGeneratorStreaming:
+    """Test streamed response generation"""
+
+    @staticmethod
+    def _collect(generator, **kwargs):
+        async def collect():
+            return [chunk async for chunk in generator.astream_response(**kwargs)]
+
+        return asyncio.run(collect())
+
+    def test_stream_continues_after_tool_round(
+        self, make_generator, mock_anthropic_client_streaming, mock_tool_manager
+    ):
+        """Tool round is executed, then the answer is streamed chunk by chunk"""
+        generator = make_generator(mock_anthropic_client_streaming)
+
+        chunks = self._collect(
+            generator, query="What is ML?", tools=_TOOLS_MIN, tool_manager=mock_tool_manager
+        )
+
+        assert chunks == ["Machine learning ", "is a subset of AI."]
+        mock_tool_manager.execute_tool.assert_called_once()
+        second_call = mock_anthropic_client_streaming.messages.stream.call_args_list[1]
+        messages = second_call.kwargs["messages"]
+        assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+        assert messages[2]["content"][0]["type"] == "tool_result"
+
+    def test_stream_without_tool_manager_stops_after_first_round(
+        self, make_generator, mock_anthropic_client_streaming
+    ):
+        """Without a tool manager a tool_use round ends the stream"""
+        generator = make_generator(mock_anthropic_client_streaming)
+
+        chunks = self._collect(generator, query="What is ML?")
+
+        assert chunks == []
+        assert mock_anthropic_client_streaming.messages.stream.call_count == 1
+
+
+class TestAIGeneratorBatch:
+    """Test Message Batches generation"""
+
+    @staticmethod
+    def _batch_client(entries):
+        mock_client = MagicMock()
+        mock_client.messages.batches.create = AsyncMock(
+            return_value=MagicMock(id="batch_1", processing_status="in_progress")
+        )
+        mock_client.messages.batches.retrieve = AsyncMock(
+            return_value=MagicMock(id="batch_1", processing_status="ended")
+        )
+
+        async def results():
+            for entry in entries:
+                yield entry
+
+        mock_client.messages.batches.results = AsyncMock(return_value=results())
+        return mock_client
+
+    @staticmethod
+    def _entry(custom_id, result_type, text=None):
+        entry = MagicMock()
+        entry.custom_id = custom_id
+        entry.result.type = result_type
+        entry.result.message.content = [MagicMock(type="text", text=text)]
+        return entry
+
+    def test_generate_batch_restores_query_order(self, make_generator, monkeypatch):
+        """Results are returned in query order regardless of completion order"""
+        mock_client = self._batch_client(
+            [self._entry("1", "succeeded", "Answer B"), self._entry("0", "succeeded", "Answer A")]
+        )
+
+        monkeypatch.setattr(config, "BATCH_POLL_INTERVAL", 0)
+        generator = make_generator(mock_client)
+
+        responses = generator.generate_batch(["Question A", "Question B"])
+
+        assert responses == ["Answer A", "Answer B"]
+        requests = mock_client.messages.batches.create.call_args.kwargs["requests"]
+        assert [r["custom_id"] for r in requests] == ["0", "1"]
+        assert requests[1]["params"]["messages"] == [{"role": "user", "content": "Question B"}]
+        assert "tools" not in requests[0]["params"]
+        mock_client.messages.batches.retrieve.assert_awaited_once_with("batch_1")
+
+    def test_generate_batch_reports_failed_requests(self, make_generator, monkeypatch):
+        """Requests that did not succeed are flagged in place"""
+        mock_client = self._batch_client(
+            [self._entry("0", "errored"), self._entry("1", "succeeded", "Answer B")]
+        )
+
+        monkeypatch.setattr(config, "BATCH_POLL_INTERVAL", 0)
+        generator = make_generator(mock_client)
+
+        responses = generator.generate_batch(["Question A", "Question B"])
+
+        assert responses == ["Batch request errored", "Answer B"]
+
+    def test_generate_batch_empty(self, make_generator):
+        """No queries means no batch is created"""
+        mock_client = self._batch_client([])
+
+        generator = make_generator(mock_client)
+
+        assert generator.generate_batch([]) == []
+        mock_client.messages.batches.create.assert_not_called()
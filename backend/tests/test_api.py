@@ -1,59 +1,57 @@
 """API endpoint tests for FastAPI application.
 
 Tests the FastAPI endpoints defined in app.py:
-- POST /api/query (line 56)
-- GET /api/courses (line 76)
-- DELETE /api/sessions/{session_id} (line 88)
+- POST /api/query
+- GET /api/courses
+- DELETE /api/sessions/{session_id}
 """
 
+import json
+
 import pytest
-from fastapi.testclient import TestClient
-from unittest.mock import MagicMock, patch
-import sys
-import os
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+pytestmark = pytest.mark.anyio
+
+# Sample aquery() results shared by the tests below (never mutated by the handlers)
+_SAMPLE_ANSWER_ML = "Machine learning is a subset of AI."
+_SAMPLE_SOURCES_ML = [{"display_text": "ML Course - Lesson 1", "url": "https://example.com/ml"}]
+_SAMPLE_QUERY_RESPONSE_ML = (_SAMPLE_ANSWER_ML, _SAMPLE_SOURCES_ML)
+_SAMPLE_QUERY_RESPONSE_MIXED_URLS = (
+    "Test answer",
+    [
+        {"display_text": "Course 1", "url": "https://example.com/1"},
+        {"display_text": "Course 2", "url": None},  # Test with None URL
+    ],
+)
 
 
 class TestQueryEndpoint:
     """Test POST /api/query endpoint"""
 
-    def test_query_endpoint_success(self, test_client, mock_rag_system):
+    async def test_query_endpoint_success(self, test_client, mock_rag_system):
         """Successful query returns answer and sources"""
         # Mock RAG system response
-        mock_rag_system.query.return_value = (
-            "Machine learning is a subset of AI.",
-            [{"display_text": "ML Course - Lesson 1", "url": "https://example.com/ml"}]
-        )
+        mock_rag_system.aquery.return_value = _SAMPLE_QUERY_RESPONSE_ML
         mock_rag_system.session_manager.create_session.return_value = "session_123"
 
-        response = test_client.post(
-            "/api/query",
-            json={"query": "What is machine learning?"}
-        )
+        response = await test_client.post("/api/query", json={"query": "What is machine learning?"})
 
         assert response.status_code == 200
         data = response.json()
         assert "answer" in data
         assert "sources" in data
         assert "session_id" in data
-        assert data["answer"] == "Machine learning is a subset of AI."
-        assert len(data["sources"]) == 1
+        assert data["answer"] == _SAMPLE_ANSWER_ML
+        assert data["sources"] == _SAMPLE_SOURCES_ML
         assert data["session_id"] == "session_123"
 
-    def test_query_endpoint_with_existing_session(self, test_client, mock_rag_system):
+    async def test_query_endpoint_with_existing_session(self, test_client, mock_rag_system):
         """Query with existing session_id maintains conversation history"""
-        mock_rag_system.query.return_value = (
-            "Deep learning uses neural networks.",
-            []
-        )
+        mock_rag_system.aquery.return_value = ("Deep learning uses neural networks.", [])
 
-        response = test_client.post(
+        response = await test_client.post(
             "/api/query",
-            json={
-                "query": "What about deep learning?",
-                "session_id": "existing_session_456"
-            }
+            json={"query": "What about deep learning?", "session_id": "existing_session_456"},
         )
 
         assert response.status_code == 200
@@ -61,76 +59,77 @@ class TestQueryEndpoint:
         assert data["session_id"] == "existing_session_456"
 
         # Verify RAG system was called with correct session
-        mock_rag_system.query.assert_called_once_with(
+        assert mock_rag_system.aquery.call_count == 1
+        assert mock_rag_system.aquery.call_args.args == (
             "What about deep learning?",
-            "existing_session_456"
+            "existing_session_456",
         )
 
-    def test_query_endpoint_with_empty_query(self, test_client, mock_rag_system):
+    async def test_query_endpoint_with_empty_query(self, test_client, mock_rag_system):
         """Empty query string is handled"""
-        mock_rag_system.query.return_value = (
+        mock_rag_system.aquery.return_value = (
             "Please ask a question about the course materials.",
-            []
+            [],
         )
         mock_rag_system.session_manager.create_session.return_value = "session_789"
 
-        response = test_client.post(
-            "/api/query",
-            json={"query": ""}
-        )
+        response = await test_client.post("/api/query", json={"query": ""})
 
         assert response.status_code == 200
         # Empty query still gets processed (validation happens in RAG system)
-        mock_rag_system.query.assert_called_once()
+        assert mock_rag_system.aquery.call_count == 1
 
-    def test_query_endpoint_invalid_json(self, test_client):
+    async def test_query_endpoint_invalid_json(self, test_client):
         """Malformed JSON returns 422"""
-        response = test_client.post(
-            "/api/query",
-            data="not valid json",
-            headers={"Content-Type": "application/json"}
+        response = await test_client.post(
+            "/api/query", content="not valid json", headers={"Content-Type": "application/json"}
         )
 
         assert response.status_code == 422
+        [error] = response.json()["detail"]
+        assert error["type"] == "json_invalid"
+        assert error["loc"] == ["body", 0]
 
-    def test_query_endpoint_missing_query_field(self, test_client):
+    async def test_query_endpoint_missing_query_field(self, test_client):
         """Missing required 'query' field returns 422"""
-        response = test_client.post(
+        response = await test_client.post(
             "/api/query",
-            json={"session_id": "test"}  # Missing 'query' field
+            json={"session_id": "test"},  # Missing 'query' field
         )
 
         assert response.status_code == 422
+        # FastAPI's standard validation error list, as for a declared body parameter
+        [error] = response.json()["detail"]
+        assert error["type"] == "missing"
+        assert error["loc"] == ["body", "query"]
+        assert error["msg"] == "Field required"
+
+    async def test_query_endpoint_non_string_session_id(self, test_client, mock_rag_system):
+        """A session_id that is not a string returns 422 before the RAG system is called"""
+        response = await test_client.post("/api/query", json={"query": "test", "session_id": 123})
 
-    def test_query_endpoint_rag_system_error(self, test_client, mock_rag_system):
+        assert response.status_code == 422
+        assert [error["loc"] for error in response.json()["detail"]] == [["body", "session_id"]]
+        assert mock_rag_system.aquery.call_count == 0
+
+    async def test_query_endpoint_rag_system_error(self, test_client, mock_rag_system):
         """RAG system exceptions return 500"""
-        mock_rag_system.query.side_effect = Exception("Vector store connection failed")
+        mock_rag_system.aquery.side_effect = Exception("Vector store connection failed")
 
-        response = test_client.post(
-            "/api/query",
-            json={"query": "test query"}
-        )
+        response = await test_client.post("/api/query", json={"query": "test query"})
 
         assert response.status_code == 500
         assert "Vector store connection failed" in response.json()["detail"]
 
-    def test_query_endpoint_response_format(self, test_client, mock_rag_system):
+    async def test_query_endpoint_response_format(self, test_client, mock_rag_system):
         """Response matches QueryResponse schema"""
-        mock_rag_system.query.return_value = (
-            "Test answer",
-            [
-                {"display_text": "Course 1", "url": "https://example.com/1"},
-                {"display_text": "Course 2", "url": None}  # Test with None URL
-            ]
-        )
+        mock_rag_system.aquery.return_value = _SAMPLE_QUERY_RESPONSE_MIXED_URLS
         mock_rag_system.session_manager.create_session.return_value = "session_abc"
 
-        response = test_client.post(
-            "/api/query",
-            json={"query": "test"}
-        )
+        response = await test_client.post("/api/query", json={"query": "test"})
 
         assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
         data = response.json()
 
         # Validate structure
@@ -143,129 +142,215 @@ class TestQueryEndpoint:
             assert "display_text" in source
             assert "url" in source
 
+    async def test_query_endpoint_schema_still_documented(self, test_client):
+        """OpenAPI keeps the request/response schemas though the handler bypasses pydantic"""
+        response = await test_client.get("/openapi.json")
 
-class TestCoursesEndpoint:
-    """Test GET /api/courses endpoint"""
+        paths = response.json()["paths"]
+        operation = paths["/api/query"]["post"]
+        request_schema = operation["requestBody"]["content"]["application/json"]["schema"]
+        response_schema = operation["responses"]["200"]["content"]["application/json"]["schema"]
+        assert request_schema["title"] == "QueryRequest"
+        assert request_schema["required"] == ["query"]
+        assert response_schema["$ref"].endswith("/QueryResponse")
+        error_schema = operation["responses"]["422"]["content"]["application/json"]["schema"]
+        assert error_schema["properties"]["detail"]["items"]["required"] == ["loc", "msg", "type"]
+        # The streaming endpoint parses the same body
+        assert paths["/api/query/stream"]["post"]["requestBody"] == operation["requestBody"]
 
-    def test_courses_endpoint_success(self, test_client, mock_rag_system):
-        """Successful request returns course statistics"""
-        mock_rag_system.get_course_analytics.return_value = {
-            "total_courses": 3,
-            "course_titles": [
-                "Machine Learning Basics",
-                "Advanced Deep Learning",
-                "Computer Vision"
-            ]
-        }
 
-        response = test_client.get("/api/courses")
+class TestQueryStreamEndpoint:
+    """Test POST /api/query/stream endpoint"""
+
+    async def test_stream_endpoint_emits_sse_events(self, test_client, mock_rag_system):
+        """Answer chunks arrive as SSE events followed by a done event"""
+        mock_rag_system.session_manager.create_session.return_value = "stream_session"
+
+        response = await test_client.post("/api/query/stream", json={"query": "What is ML?"})
 
         assert response.status_code == 200
-        data = response.json()
-        assert "total_courses" in data
-        assert "course_titles" in data
-        assert data["total_courses"] == 3
-        assert len(data["course_titles"]) == 3
+        assert response.headers["content-type"].startswith("text/event-stream")
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert "".join(e["text"] for e in events if e["type"] == "text") == (
+            "This is a test response."
+        )
+        assert events[-1] == {"type": "done", "sources": [], "session_id": "stream_session"}
 
-    def test_courses_endpoint_empty_database(self, test_client, mock_rag_system):
-        """Empty database returns zero courses"""
-        mock_rag_system.get_course_analytics.return_value = {
-            "total_courses": 0,
-            "course_titles": []
-        }
+    async def test_stream_endpoint_reports_errors_in_band(self, test_client, mock_rag_system):
+        """Errors after the stream starts are sent as an error event"""
 
-        response = test_client.get("/api/courses")
+        async def failing_stream(query, session_id):
+            raise Exception("Vector store connection failed")
+            yield  # pragma: no cover - makes this an async generator
+
+        mock_rag_system.astream_query.side_effect = failing_stream
+
+        response = await test_client.post("/api/query/stream", json={"query": "test"})
 
         assert response.status_code == 200
-        data = response.json()
-        assert data["total_courses"] == 0
-        assert data["course_titles"] == []
+        events = [
+            json.loads(line[len("data: ") :])
+            for line in response.text.splitlines()
+            if line.startswith("data: ")
+        ]
+        assert events == [{"type": "error", "detail": "Vector store connection failed"}]
 
-    def test_courses_endpoint_error(self, test_client, mock_rag_system):
-        """Analytics error returns 500"""
-        mock_rag_system.get_course_analytics.side_effect = Exception("Database error")
+    async def test_stream_endpoint_rejects_non_string_query(self, test_client, mock_rag_system):
+        """The stream endpoint validates its body like /api/query"""
+        response = await test_client.post("/api/query/stream", json={"query": 42})
 
-        response = test_client.get("/api/courses")
+        assert response.status_code == 422
+        assert mock_rag_system.astream_query.call_count == 0
 
-        assert response.status_code == 500
-        assert "Database error" in response.json()["detail"]
 
-    def test_courses_endpoint_response_format(self, test_client, mock_rag_system):
-        """Response matches CourseStats schema"""
+class TestCoursesEndpoint:
+    """Test GET /api/courses endpoint"""
+
+    @pytest.mark.parametrize(
+        "course_titles",
+        [
+            ["Machine Learning Basics", "Advanced Deep Learning", "Computer Vision"],
+            [],  # Empty database returns zero courses
+            ["Test Course"],
+        ],
+        ids=["several_courses", "empty_database", "single_course"],
+    )
+    async def test_courses_endpoint_returns_stats(
+        self, test_client, mock_rag_system, course_titles
+    ):
+        """Successful request returns course statistics matching the CourseStats schema"""
         mock_rag_system.get_course_analytics.return_value = {
-            "total_courses": 1,
-            "course_titles": ["Test Course"]
+            "total_courses": len(course_titles),
+            "course_titles": course_titles,
         }
 
-        response = test_client.get("/api/courses")
+        response = await test_client.get("/api/courses")
 
         assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
         data = response.json()
+        assert data["total_courses"] == len(course_titles)
+        assert data["course_titles"] == course_titles
 
         # Validate types
         assert isinstance(data["total_courses"], int)
-        assert isinstance(data["course_titles"], list)
-        for title in data["course_titles"]:
-            assert isinstance(title, str)
+        assert all(isinstance(title, str) for title in data["course_titles"])
 
+    async def test_courses_endpoint_error(self, test_client, mock_rag_system):
+        """Analytics error returns 500"""
+        mock_rag_system.get_course_analytics.side_effect = Exception("Database error")
 
-class TestSessionsEndpoint:
-    """Test DELETE /api/sessions/{session_id} endpoint"""
+        response = await test_client.get("/api/courses")
 
-    def test_clear_session_success(self, test_client, mock_rag_system):
-        """Successful session clear returns status"""
-        response = test_client.delete("/api/sessions/test_session_123")
+        assert response.status_code == 500
+        assert "Database error" in response.json()["detail"]
 
-        assert response.status_code == 200
-        data = response.json()
-        assert data["status"] == "cleared"
-        assert data["session_id"] == "test_session_123"
+    async def test_courses_endpoint_cached_until_catalog_changes(
+        self, test_client, mock_rag_system
+    ):
+        """Repeat requests reuse the encoded response until course_version changes"""
+        first = await test_client.get("/api/courses")
+        second = await test_client.get("/api/courses")
 
-        # Verify session was cleared
-        mock_rag_system.session_manager.clear_session.assert_called_once_with(
-            "test_session_123"
+        assert first.content == second.content
+        assert first.headers["etag"] == second.headers["etag"]
+        assert first.headers["cache-control"].startswith("max-age=")
+        assert mock_rag_system.get_course_analytics.call_count == 1
+
+        mock_rag_system.course_version += 1
+        mock_rag_system.get_course_analytics.return_value = {
+            "total_courses": 3,
+            "course_titles": ["Course 1", "Course 2", "Course 3"],
+        }
+        third = await test_client.get("/api/courses")
+
+        assert third.json()["total_courses"] == 3
+        assert third.headers["etag"] != first.headers["etag"]
+        assert mock_rag_system.get_course_analytics.call_count == 2
+
+    @pytest.mark.parametrize(
+        "if_none_match",
+        [
+            "{etag}",
+            '"stale", {etag}',  # A list of cached tags
+            "W/{etag}",  # Weakened by a proxy
+            "*",
+        ],
+        ids=["exact", "list", "weak", "any"],
+    )
+    async def test_courses_endpoint_not_modified(self, test_client, mock_rag_system, if_none_match):
+        """A matching If-None-Match gets 304 with no body"""
+        etag = (await test_client.get("/api/courses")).headers["etag"]
+
+        response = await test_client.get(
+            "/api/courses", headers={"If-None-Match": if_none_match.format(etag=etag)}
         )
 
-    def test_clear_session_with_special_characters(self, test_client, mock_rag_system):
-        """Session ID with special characters is handled"""
-        session_id = "session-with-dashes_and_underscores"
-        response = test_client.delete(f"/api/sessions/{session_id}")
+        assert response.status_code == 304
+        assert response.content == b""
+        assert response.headers["etag"] == etag
+
+    async def test_courses_endpoint_stale_etag_gets_full_response(
+        self, test_client, mock_rag_system
+    ):
+        """If-None-Match listing only other tags gets the full 200 response"""
+        response = await test_client.get(
+            "/api/courses", headers={"If-None-Match": '"stale", W/"older"'}
+        )
 
         assert response.status_code == 200
-        data = response.json()
-        assert data["session_id"] == session_id
+        assert response.json()["total_courses"] == 2
+
+
+class TestSessionsEndpoint:
+    """Test DELETE /api/sessions/{session_id} endpoint"""
 
-    def test_clear_nonexistent_session(self, test_client, mock_rag_system):
-        """Clearing non-existent session succeeds (idempotent)"""
-        # SessionManager.clear_session is idempotent
-        response = test_client.delete("/api/sessions/nonexistent_session")
+    @pytest.mark.parametrize(
+        "session_id",
+        [
+            "test_session_123",
+            "session-with-dashes_and_underscores",  # Special characters are handled
+            "nonexistent_session",  # SessionManager.clear_session is idempotent
+        ],
+    )
+    async def test_clear_session(self, test_client, mock_rag_system, session_id):
+        """Clearing a session returns its status and id"""
+        response = await test_client.delete(f"/api/sessions/{session_id}")
 
         assert response.status_code == 200
+        assert response.headers["content-type"].startswith("application/json")
         data = response.json()
         assert data["status"] == "cleared"
+        assert data["session_id"] == session_id
+
+        # Verify session was cleared
+        clear_session = mock_rag_system.session_manager.clear_session
+        assert clear_session.call_count == 1
+        assert clear_session.call_args.args == (session_id,)
 
 
 class TestErrorHandling:
     """Test error handling across endpoints"""
 
-    def test_404_for_unknown_endpoint(self, test_client):
+    async def test_404_for_unknown_endpoint(self, test_client):
         """Unknown endpoint returns 404"""
-        response = test_client.get("/api/unknown")
+        response = await test_client.get("/api/unknown")
         assert response.status_code == 404
 
-    def test_method_not_allowed(self, test_client):
+    async def test_method_not_allowed(self, test_client):
         """Wrong HTTP method returns 405"""
-        response = test_client.get("/api/query")  # Should be POST
+        response = await test_client.get("/api/query")  # Should be POST
         assert response.status_code == 405
 
-    def test_internal_error_format(self, test_client, mock_rag_system):
+    async def test_internal_error_format(self, test_client, mock_rag_system):
         """500 errors return proper JSON format"""
-        mock_rag_system.query.side_effect = Exception("Internal error")
+        mock_rag_system.aquery.side_effect = Exception("Internal error")
 
-        response = test_client.post(
-            "/api/query",
-            json={"query": "test"}
-        )
+        response = await test_client.post("/api/query", json={"query": "test"})
 
         assert response.status_code == 500
         data = response.json()
@@ -276,62 +361,49 @@ class TestErrorHandling:
 class TestIntegrationFlow:
     """Test complete user flow across endpoints"""
 
-    def test_full_conversation_flow(self, test_client, mock_rag_system):
+    async def test_full_conversation_flow(self, test_client, mock_rag_system):
         """Complete flow: query -> check courses -> clear session"""
         # Setup mocks
         mock_rag_system.session_manager.create_session.return_value = "flow_session"
-        mock_rag_system.query.return_value = ("Answer 1", [])
+        mock_rag_system.aquery.return_value = ("Answer 1", [])
         mock_rag_system.get_course_analytics.return_value = {
             "total_courses": 5,
-            "course_titles": ["Course A"]
+            "course_titles": ["Course A"],
         }
 
         # Step 1: Initial query (creates session)
-        response1 = test_client.post(
-            "/api/query",
-            json={"query": "First question"}
-        )
+        response1 = await test_client.post("/api/query", json={"query": "First question"})
         assert response1.status_code == 200
         session_id = response1.json()["session_id"]
 
         # Step 2: Follow-up query with same session
-        response2 = test_client.post(
-            "/api/query",
-            json={"query": "Follow-up question", "session_id": session_id}
+        response2 = await test_client.post(
+            "/api/query", json={"query": "Follow-up question", "session_id": session_id}
         )
         assert response2.status_code == 200
         assert response2.json()["session_id"] == session_id
 
         # Step 3: Check available courses
-        response3 = test_client.get("/api/courses")
+        response3 = await test_client.get("/api/courses")
         assert response3.status_code == 200
         assert response3.json()["total_courses"] == 5
 
         # Step 4: Clear session
-        response4 = test_client.delete(f"/api/sessions/{session_id}")
+        response4 = await test_client.delete(f"/api/sessions/{session_id}")
         assert response4.status_code == 200
         assert response4.json()["status"] == "cleared"
 
-    def test_multiple_concurrent_sessions(self, test_client, mock_rag_system):
+    async def test_multiple_concurrent_sessions(self, test_client, mock_rag_system):
         """Multiple sessions can operate independently"""
-        mock_rag_system.session_manager.create_session.side_effect = [
-            "session_A",
-            "session_B"
-        ]
-        mock_rag_system.query.return_value = ("Answer", [])
+        mock_rag_system.session_manager.create_session.side_effect = ["session_A", "session_B"]
+        mock_rag_system.aquery.return_value = ("Answer", [])
 
         # Create first session
-        response1 = test_client.post(
-            "/api/query",
-            json={"query": "Question from user A"}
-        )
+        response1 = await test_client.post("/api/query", json={"query": "Question from user A"})
         session_a = response1.json()["session_id"]
 
         # Create second session
-        response2 = test_client.post(
-            "/api/query",
-            json={"query": "Question from user B"}
-        )
+        response2 = await test_client.post("/api/query", json={"query": "Question from user B"})
         session_b = response2.json()["session_id"]
 
         # Sessions are independent
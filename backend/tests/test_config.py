@@ -5,11 +5,6 @@ The test_max_results_is_positive test will FAIL with the current config,
 exposing the MAX_RESULTS=0 bug.
 """
 
-import os
-import sys
-
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
-
 from config import Config, config
 
 
@@ -23,8 +18,9 @@ class TestConfigValidation:
         which causes all searches to return empty results.
         """
         assert config.MAX_RESULTS > 0, (
-            f"MAX_RESULTS is {config.MAX_RESULTS}, but must be > 0 "
-            "for vector search to return any results"
+            f"MAX_RESULTS is {config.MAX_RESULTS}, but must be > 0: RAGSystem passes it to "
+            "VectorStore as the ChromaDB search limit, so every search returns no documents "
+            "and the chatbot answers 'query failed'"
         )
 
     def test_max_results_reasonable_upper_bound(self):
@@ -1,24 +1,28 @@
 """Integration tests for RAGSystem.
 
-Tests the query() method at line 104 and exposes the MAX_RESULTS=0 bug.
+Tests query() and aquery(), which it wraps.
 """
 
-import os
-import sys
+import asyncio
+import threading
+from contextlib import asynccontextmanager
 from dataclasses import dataclass
-from unittest.mock import patch
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
 
 import pytest
+from models import Course
+from rag_system import RAGSystem
+from vector_store import SearchResults
 
-sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
 
-
-@dataclass
+@dataclass(frozen=True, slots=True)
 class MockConfig:
     """Mock config for testing"""
 
     ANTHROPIC_API_KEY: str = "test_api_key"
     ANTHROPIC_MODEL: str = "claude-test"
+    ANTHROPIC_ROUTER_MODEL: str = ""
     EMBEDDING_MODEL: str = "all-MiniLM-L6-v2"
     CHUNK_SIZE: int = 800
     CHUNK_OVERLAP: int = 100
@@ -27,218 +31,293 @@ class MockConfig:
     CHROMA_PATH: str = "./test_chroma_db"
 
 
-class TestRAGSystemQueryOrchestration:
-    """Test RAGSystem.query() orchestration at line 104"""
+MOCK_CONFIG = MockConfig()
 
-    def test_query_orchestration(self, mock_anthropic_client, mock_vector_store):
-        """Components are wired correctly"""
-        with (
-            patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client),
-            patch("rag_system.VectorStore", return_value=mock_vector_store),
-        ):
-            from rag_system import RAGSystem
 
-            config = MockConfig()
-            rag = RAGSystem(config)
+@pytest.fixture
+def rag(mock_anthropic_client):
+    """RAGSystem wired to the mocked Anthropic client and a mocked vector store"""
+    with patch("rag_system.VectorStore"):
+        rag = RAGSystem(MOCK_CONFIG)
+    rag.ai_generator.client = mock_anthropic_client
+    return rag
+
 
-            # Override components with mocks
-            rag.vector_store = mock_vector_store
-            rag.ai_generator.client = mock_anthropic_client
+class TestRAGSystemQueryOrchestration:
+    """Test RAGSystem.query() orchestration through aquery()"""
 
-            response, sources = rag.query("What is machine learning?")
+    def test_query_orchestration(self, rag):
+        """Components are wired correctly"""
+        response, sources = rag.query("What is machine learning?")
 
-            # Should return a response
-            assert response is not None
-            assert isinstance(response, str)
+        # Should return a response
+        assert response is not None
+        assert isinstance(response, str)
 
-    def test_session_management(self, mock_anthropic_client, mock_vector_store):
+    def test_session_management(self, rag):
         """History is retrieved and updated correctly"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+        # Create a session
+        session_id = "test_session_1"
+
+        # First query
+        rag.query("First question", session_id=session_id)
+
+        # Check history was stored
+        history = rag.session_manager.get_conversation_history(session_id)
+        assert history is not None
+        assert "First question" in history
+
+    def test_stale_tool_sources_not_returned(self, rag):
+        """Only sources from this query's tool calls are returned"""
+        # Left over from an earlier synchronous execute()
+        rag.search_tool.last_sources = [
+            {"display_text": "Test Course - Lesson 1", "url": "https://test.com"}
+        ]
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.ai_generator.client = mock_anthropic_client
+        response, sources = rag.query("test query")
 
-                # Create a session
-                session_id = "test_session_1"
+        # The mocked client answers without calling tools
+        assert sources == []
 
-                # First query
-                rag.query("First question", session_id=session_id)
+    def test_tools_registered(self, rag):
+        """Both search and outline tools are available"""
+        tools = rag.tool_manager.get_tool_definitions()
+        tool_names = [t["name"] for t in tools]
 
-                # Check history was stored
-                history = rag.session_manager.get_conversation_history(session_id)
-                assert history is not None
-                assert "First question" in history
+        assert "search_course_content" in tool_names
+        assert "get_course_outline" in tool_names
+        # The generator is handed the same definitions once, at construction
+        generator_tool_names = [t["name"] for t in rag.ai_generator.tools]
+        assert generator_tool_names == tool_names
 
-    def test_source_extraction_and_reset(
-        self, mock_anthropic_client, mock_vector_store, sample_search_results
-    ):
-        """Sources are returned then cleared"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.ai_generator.client = mock_anthropic_client
-                rag.vector_store = mock_vector_store
+class TestRAGSystemIntegration:
+    """Integration tests for full query flow"""
 
-                # Set up search tool with sources
-                rag.search_tool.last_sources = [
-                    {"display_text": "Test Course - Lesson 1", "url": "https://test.com"}
-                ]
+    def test_query_returns_tuple(self, rag):
+        """Query returns (response, sources) tuple"""
+        result = rag.query("test query")
 
-                response, sources = rag.query("test query")
+        assert isinstance(result, tuple)
+        assert len(result) == 2
+        response, sources = result
+        assert isinstance(response, str)
+        assert isinstance(sources, list)
 
-                # Sources should be returned
-                assert sources is not None
+    def test_query_without_session(self, rag):
+        """Query works without session ID"""
+        response, sources = rag.query("test query", session_id=None)
 
-                # Sources should be reset after query
-                assert rag.search_tool.last_sources == []
+        assert response is not None
 
-    def test_tools_registered(self, mock_anthropic_client, mock_vector_store):
-        """Both search and outline tools are available"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+    def test_query_with_new_session(self, rag):
+        """Query creates history for new session"""
+        response, sources = rag.query("What is ML?", session_id="new_session")
+
+        # Session should now have history
+        history = rag.session_manager.get_conversation_history("new_session")
+        assert history is not None
+        assert "What is ML?" in history
+
+    def test_query_sends_session_history_as_messages(self, rag, mock_anthropic_client):
+        """Follow-up queries carry earlier turns as messages, not in the system prompt"""
+        rag.query("What is ML?", session_id="follow_up")
+        rag.query("Tell me more", session_id="follow_up")
+
+        call_args = mock_anthropic_client.messages.create.call_args
+        messages = call_args.kwargs["messages"]
+        assert [m["role"] for m in messages] == ["user", "assistant", "user"]
+        assert messages[0]["content"] == "What is ML?"
+        assert len(call_args.kwargs["system"]) == 1
+
+    def test_empty_answer_left_out_of_history(
+        self, rag, build_mock_anthropic, mock_anthropic_client
+    ):
+        """An exchange whose answer was empty is not sent back to the API"""
+        rag.ai_generator.client = build_mock_anthropic([("end_turn", "")])
+        rag.query("What is ML?", session_id="empty_answer")
+        rag.query("What is DL?", session_id="empty_answer")
+
+        rag.ai_generator.client = mock_anthropic_client
+        rag.query("Tell me more", session_id="empty_answer")
+
+        messages = mock_anthropic_client.messages.create.call_args.kwargs["messages"]
+        assert messages == [
+            {"role": "user", "content": "Answer this question about course materials: Tell me more"}
+        ]
 
-                config = MockConfig()
-                rag = RAGSystem(config)
+    def test_stream_query_records_history(self, rag, mock_anthropic_client_streaming):
+        """Streamed answer ends with a done event and is stored in history"""
+        rag.ai_generator.client = mock_anthropic_client_streaming
+
+        async def collect():
+            return [event async for event in rag.astream_query("What is ML?", "stream_session")]
+
+        events = asyncio.run(collect())
+
+        text = "".join(e["text"] for e in events if e["type"] == "text")
+        assert text == "Machine learning is a subset of AI."
+        assert events[-1]["type"] == "done"
+        assert isinstance(events[-1]["sources"], list)
+        history = rag.session_manager.get_conversation_history("stream_session")
+        assert "Machine learning is a subset of AI." in history
+
+
+class FakeSearchingClient:
+    """
+    AsyncAnthropic stand-in that searches for the question it is asked, then answers.
+
+    The question is read from the request itself rather than replayed in call order, so
+    concurrent queries can interleave on one client. Each call yields to the event loop
+    first to force that interleaving.
+    """
+
+    def __init__(self):
+        self.messages = SimpleNamespace(create=self.create, stream=self.stream)
+
+    async def create(self, **kwargs):
+        await asyncio.sleep(0)
+        messages = kwargs["messages"]
+        question = messages[0]["content"].rsplit(": ", 1)[1]
+        if len(messages) == 1:
+            block = SimpleNamespace(
+                type="tool_use",
+                name="search_course_content",
+                id=f"tool_{question}",
+                input={"query": question},
+            )
+            return SimpleNamespace(stop_reason="tool_use", content=[block])
+        text = SimpleNamespace(type="text", text=f"Answer to {question}")
+        return SimpleNamespace(stop_reason="end_turn", content=[text])
 
-                tools = rag.tool_manager.get_tool_definitions()
-                tool_names = [t["name"] for t in tools]
+    @asynccontextmanager
+    async def stream(self, **kwargs):
+        response = await self.create(**kwargs)
 
-                assert "search_course_content" in tool_names
-                assert "get_course_outline" in tool_names
+        async def text_stream():
+            for block in response.content:
+                if block.type == "text":
+                    yield block.text
 
+        async def get_final_message():
+            return response
 
-class TestRAGSystemMaxResultsBug:
-    """Tests that expose the MAX_RESULTS=0 bug"""
+        yield SimpleNamespace(text_stream=text_stream(), get_final_message=get_final_message)
 
-    def test_query_with_max_results_zero_returns_empty(self):
-        """
-        When MAX_RESULTS=0 in config, vector search returns empty results.
 
-        This test exposes the bug by directly testing VectorStore behavior
-        with max_results=0.
-        """
-        # Create a VectorStore with max_results=0 (the bug)
-        # We can't easily test the full integration without ChromaDB,
-        # but we can verify that the config value would cause issues
+class TestRAGSystemConcurrentQueries:
+    """Queries running at once on one RAGSystem each get their own sources"""
 
-        from config import config as real_config
+    @pytest.fixture
+    def searching_rag(self, rag):
+        """rag whose searches return one source named after the search query"""
+        both_searching = threading.Barrier(2, timeout=5)
 
-        # This assertion will FAIL if MAX_RESULTS=0
-        # (same as test_config.py but focused on the search impact)
-        if real_config.MAX_RESULTS == 0:
-            pytest.fail(
-                f"MAX_RESULTS is {real_config.MAX_RESULTS}. "
-                "This causes VectorStore.search() to always return empty results, "
-                "which makes the RAG chatbot return 'query failed' for all queries."
+        def search(query, **_):
+            # Hold each search until the other query is searching too, so they overlap
+            both_searching.wait()
+            return SearchResults(
+                documents=[f"About {query}"],
+                metadata=[{"course_title": f"Course {query}", "lesson_number": 1}],
+                distances=[0.1],
             )
 
-    def test_vector_store_search_limit_from_config(self):
-        """Verify that MAX_RESULTS is used as search limit in VectorStore"""
-        from config import config as real_config
+        rag.ai_generator.client = FakeSearchingClient()
+        rag.vector_store.search.side_effect = search
+        return rag
 
-        # The bug: MAX_RESULTS=0 means ChromaDB returns 0 documents
-        # This test documents the expected behavior
-        assert real_config.MAX_RESULTS > 0, (
-            f"MAX_RESULTS={real_config.MAX_RESULTS} will cause "
-            "vector_store.py:90 to request 0 results from ChromaDB"
-        )
+    def test_concurrent_queries_keep_their_sources(self, searching_rag):
+        """Each answer carries only the sources its own search returned"""
 
-    def test_rag_system_initializes_vector_store_with_max_results(self, mock_anthropic_client):
-        """RAGSystem passes MAX_RESULTS to VectorStore at rag_system.py:18"""
-        from config import config as real_config
+        async def ask_both():
+            return await asyncio.gather(searching_rag.aquery("A?"), searching_rag.aquery("B?"))
 
-        # Document the flow: config.MAX_RESULTS -> VectorStore.__init__ -> search()
-        # If MAX_RESULTS=0, the search at vector_store.py:90 returns nothing
+        (answer_a, sources_a), (answer_b, sources_b) = asyncio.run(ask_both())
 
-        assert real_config.MAX_RESULTS > 0, (
-            "rag_system.py:18 passes config.MAX_RESULTS to VectorStore. "
-            f"Current value is {real_config.MAX_RESULTS}, which breaks search."
-        )
+        assert answer_a == "Answer to A?"
+        assert [s["display_text"] for s in sources_a] == ["Course A? - Lesson 1"]
+        assert answer_b == "Answer to B?"
+        assert [s["display_text"] for s in sources_b] == ["Course B? - Lesson 1"]
 
+    def test_concurrent_streams_keep_their_sources(self, searching_rag):
+        """Each stream's done event carries only its own sources"""
 
-class TestRAGSystemIntegration:
-    """Integration tests for full query flow"""
+        async def done_event(query):
+            return [event async for event in searching_rag.astream_query(query)][-1]
 
-    def test_query_returns_tuple(self, mock_anthropic_client, mock_vector_store):
-        """Query returns (response, sources) tuple"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+        async def stream_both():
+            return await asyncio.gather(done_event("A?"), done_event("B?"))
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.ai_generator.client = mock_anthropic_client
+        done_a, done_b = asyncio.run(stream_both())
 
-                result = rag.query("test query")
+        assert [s["display_text"] for s in done_a["sources"]] == ["Course A? - Lesson 1"]
+        assert [s["display_text"] for s in done_b["sources"]] == ["Course B? - Lesson 1"]
 
-                assert isinstance(result, tuple)
-                assert len(result) == 2
-                response, sources = result
-                assert isinstance(response, str)
-                assert isinstance(sources, list)
 
-    def test_query_without_session(self, mock_anthropic_client, mock_vector_store):
-        """Query works without session ID"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+class TestRAGSystemStreamFailure:
+    """A stream that fails part-way leaves nothing behind for later queries"""
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.ai_generator.client = mock_anthropic_client
+    def test_failed_stream_leaves_no_sources_for_next_query(self, rag, mock_anthropic_client):
+        """Sources found before a stream fails are not returned by the next query"""
 
-                response, sources = rag.query("test query", session_id=None)
+        class FailingAfterSearch(FakeSearchingClient):
+            async def create(self, **kwargs):
+                if len(kwargs["messages"]) > 1:
+                    raise RuntimeError("API unavailable")
+                return await super().create(**kwargs)
 
-                assert response is not None
+        rag.ai_generator.client = FailingAfterSearch()
+        rag.vector_store.search.return_value = SearchResults(
+            documents=["About A"],
+            metadata=[{"course_title": "Course A", "lesson_number": 1}],
+            distances=[0.1],
+        )
 
-    def test_query_with_new_session(self, mock_anthropic_client, mock_vector_store):
-        """Query creates history for new session"""
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+        async def consume():
+            return [event async for event in rag.astream_query("A?")]
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.ai_generator.client = mock_anthropic_client
+        with pytest.raises(RuntimeError, match="API unavailable"):
+            asyncio.run(consume())
 
-                response, sources = rag.query("What is ML?", session_id="new_session")
+        rag.ai_generator.client = mock_anthropic_client
+        _, sources = rag.query("B?")
 
-                # Session should now have history
-                history = rag.session_manager.get_conversation_history("new_session")
-                assert history is not None
-                assert "What is ML?" in history
+        assert sources == []
 
 
 class TestRAGSystemCourseAnalytics:
     """Test course analytics method"""
 
-    def test_get_course_analytics(self, mock_anthropic_client, mock_vector_store):
+    def test_get_course_analytics(self, rag):
         """Analytics returns expected structure"""
-        mock_vector_store.get_course_count.return_value = 3
-        mock_vector_store.get_existing_course_titles.return_value = [
+        rag.vector_store.get_course_count.return_value = 3
+        rag.vector_store.get_existing_course_titles.return_value = [
             "Course 1",
             "Course 2",
             "Course 3",
         ]
 
-        with patch("ai_generator.anthropic.Anthropic", return_value=mock_anthropic_client):
-            with patch("rag_system.VectorStore", return_value=mock_vector_store):
-                from rag_system import RAGSystem
+        analytics = rag.get_course_analytics()
+
+        assert "total_courses" in analytics
+        assert "course_titles" in analytics
+        assert analytics["total_courses"] == 3
+        assert len(analytics["course_titles"]) == 3
+
+    def test_course_version_bumped_on_ingest(self, rag, tmp_path):
+        """Adding courses or clearing data invalidates cached analytics; no-ops do not"""
+        course = Course(title="Course 1")
+        rag.document_processor = MagicMock()
+        rag.document_processor.process_course_document.return_value = (course, [])
 
-                config = MockConfig()
-                rag = RAGSystem(config)
-                rag.vector_store = mock_vector_store
+        rag.add_course_document("course1.txt")
+        assert rag.course_version == 1
 
-                analytics = rag.get_course_analytics()
+        # Folder with only an already-known course changes nothing
+        (tmp_path / "course1.txt").write_text("Course Title: Course 1")
+        rag.vector_store.get_existing_course_titles.return_value = ["Course 1"]
+        rag.add_course_folder(str(tmp_path))
+        assert rag.course_version == 1
 
-                assert "total_courses" in analytics
-                assert "course_titles" in analytics
-                assert analytics["total_courses"] == 3
-                assert len(analytics["course_titles"]) == 3
+        rag.add_course_folder(str(tmp_path), clear_existing=True)
+        assert rag.course_version == 2